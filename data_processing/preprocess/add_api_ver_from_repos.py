@@ -7,87 +7,229 @@
 - 输出带 api_ver 的新 JSONL；并在控制台统计未写入 api_ver 的记录条数
 
 用法：
-  python add_api_ver_from_repos.py --repos-file <arkts_repos.json> --input-jsonl <data.jsonl> --output-jsonl <out.jsonl>
+  python add_api_ver_from_repos.py --repos-file <arkts_repos.json> --input-jsonl <data.jsonl> --output-jsonl <out.jsonl> [--workers N] [--only-matched]
 默认：
   --repos-file 为脚本同级 arkts_repos.json
   --output-jsonl 默认为 <input-jsonl> 同目录下追加后缀 _with_api_ver.jsonl
 """
 
 import os
+import re
 import json
+import pickle
+import shutil
 import argparse
+from multiprocessing import Pool
 from pathlib import Path
-from typing import Dict, Any, List, Tuple
+from typing import Dict, Any, BinaryIO, Iterable, Iterator, List, Optional, Pattern, Tuple
+
+# pickle 缓存格式版本：修改 id 归一化方式或缓存内容时递增，旧缓存（含无版本号的）会被重建
+API_VER_CACHE_VERSION = 2
+
+# JSONL 读写缓冲区大小
+IO_BUFFER_SIZE = 1 << 20
 
 
 def load_repos_mapping(repos_file: Path) -> Dict[str, Any]:
     """
     加载 arkts_repos.json，构建 id -> api_ver 的映射。
+    id 在加载时统一 strip + lower，匹配阶段不再逐次归一化；
+    仅大小写不同的 id 会冲突，此时保留先出现的条目并告警。
     支持两种结构：
       - 列表: [{"repo_name": ..., "author": ..., "id": ..., "api_ver": ...}, ...]
       - 字典: {"repos": [ ... 如上 ... ]}
     """
     if not repos_file.exists():
         raise FileNotFoundError(f"repos 文件不存在: {repos_file}")
+    # 解析结果按 mtime 缓存为 pickle，repos 文件未变化时跳过 JSON 解析
+    mtime = repos_file.stat().st_mtime
+    cache_path = repos_file.with_suffix('.api_ver.pkl')
+    try:
+        with open(cache_path, 'rb') as f:
+            cached_version, cached_mtime, cached_mapping = pickle.load(f)
+        if cached_version == API_VER_CACHE_VERSION and cached_mtime == mtime:
+            return cached_mapping
+    except Exception:
+        pass
     with open(repos_file, 'r', encoding='utf-8') as f:
         data = json.load(f)
     items = data.get('repos', data) if isinstance(data, dict) else data
     mapping: Dict[str, Any] = {}
     if not isinstance(items, list):
         return mapping
+    # 小写后的 id -> 首次出现的原始 id，用于发现仅大小写不同的 id 冲突
+    first_raw_id: Dict[str, str] = {}
+    collisions: List[Tuple[str, str]] = []
     for it in items:
         if not isinstance(it, dict):
             continue
-        rid = str(it.get('id', '') or '').strip()
+        raw_id = str(it.get('id', '') or '').strip()
+        rid = raw_id.lower()
         if not rid:
             continue
+        seen_raw_id = first_raw_id.setdefault(rid, raw_id)
+        if seen_raw_id != raw_id:
+            # 仅大小写不同的 id 归一后冲突：保留先出现的 api_ver，不静默覆盖
+            collisions.append((seen_raw_id, raw_id))
+            continue
         api_ver = it.get('api_ver')
         mapping[rid] = api_ver
+    if collisions:
+        print(f"⚠️ {len(collisions)} 个 id 仅大小写不同，已保留先出现的 api_ver，例如: {collisions[:5]}")
+    try:
+        with open(cache_path, 'wb') as f:
+            pickle.dump((API_VER_CACHE_VERSION, mtime, mapping), f, protocol=pickle.HIGHEST_PROTOCOL)
+    except OSError:
+        pass
     return mapping
 
 
-def process_jsonl(input_jsonl: Path, output_jsonl: Path, key_to_api: Dict[str, Any]) -> Tuple[int, int, int]:
+def build_repo_id_pattern(key_to_api: Dict[str, Any]) -> Optional[Pattern[str]]:
     """
-    读取 input_jsonl，匹配并补充 api_ver，写入 output_jsonl。
+    将全部 repo id 编译为一个正则并集（长 id 优先），
+    一次 search 即可在 C 层完成所有 id 的包含匹配。映射为空时返回 None。
+    """
+    rids = [rid for rid in key_to_api if rid]
+    if not rids:
+        return None
+    rids.sort(key=len, reverse=True)
+    return re.compile('|'.join(re.escape(rid) for rid in rids))
+
+
+def _process_lines(lines: Iterable[bytes], fout: BinaryIO, key_to_api: Dict[str, Any],
+                   pattern: Optional[Pattern[str]], only_matched: bool = False) -> Tuple[int, int, int]:
+    """
+    处理一组原始 JSONL 行：匹配并补充 api_ver 后写入 fout。
+    only_matched 为 True 时只写出本次新补充了 api_ver 的记录。
     返回 (total, matched, missing_api_ver_after)
     """
     total = 0
     matched = 0
     missing_after = 0
 
-    # 确保输出目录存在
-    output_jsonl.parent.mkdir(parents=True, exist_ok=True)
-
-    with open(input_jsonl, 'r', encoding='utf-8') as fin, open(output_jsonl, 'w', encoding='utf-8') as fout:
-        for line_num, line in enumerate(fin, 1):
-            line = line.strip()
-            if not line:
-                continue
-            try:
-                rec = json.loads(line)
-            except json.JSONDecodeError:
-                # 跳过损坏行
-                continue
+    for line in lines:
+        line = line.strip()
+        if not line:
+            continue
+        # 已带 api_ver 的记录无需补充，原样写出，省去一次 JSON 解析与序列化；
+        # 不是 '{...}' 形式的行不可能是合法记录，交给下面的 JSON 解析按损坏行跳过
+        if line[:1] == b'{' and line[-1:] == b'}' and b'"api_ver"' in line:
             total += 1
+            if only_matched:
+                continue
+            fout.write(line)
+            fout.write(b'\n')
+            continue
+        try:
+            rec = json.loads(line)
+        except ValueError:
+            # 跳过损坏行（含非法 JSON 与非法 UTF-8）
+            continue
+        total += 1
+
+        # 若已有 api_ver 则保留；否则尝试补充
+        updated = False
+        if 'api_ver' not in rec:
+            proj = str(rec.get('project_name', '') or '').strip()
+            if proj and pattern is not None:
+                # 用 project_name 与 repos 中的 id 做包含匹配
+                m = pattern.search(proj.lower())
+                if m:
+                    rec['api_ver'] = key_to_api[m.group(0)]
+                    matched += 1
+                    updated = True
+
+        # 统计仍无 api_ver 的记录
+        if 'api_ver' not in rec:
+            missing_after += 1
+
+        if only_matched and not updated:
+            continue
+        fout.write(json.dumps(rec, ensure_ascii=False).encode('utf-8'))
+        fout.write(b'\n')
+
+    return total, matched, missing_after
+
+
+def _iter_range_lines(fin: BinaryIO, start: int, end: int) -> Iterator[bytes]:
+    """
+    逐行产出起始偏移落在 [start, end) 内的行。
+    start 不在行首时跳过残缺的首行（该行归前一个分片处理）。
+    """
+    if start > 0:
+        fin.seek(start - 1)
+        pos = start - 1 + len(fin.readline())
+    else:
+        fin.seek(0)
+        pos = 0
+    while pos < end:
+        line = fin.readline()
+        if not line:
+            break
+        pos += len(line)
+        yield line
+
+
+# worker 进程内的共享状态，由 _init_worker 在进程启动时设置一次，避免逐任务 pickle 大映射
+_worker_key_to_api: Dict[str, Any] = {}
+_worker_pattern: Optional[Pattern[str]] = None
+
 
-            # 若已有 api_ver 则保留；否则尝试补充
-            if 'api_ver' not in rec:
-                proj = str(rec.get('project_name', '') or '').strip()
-                if proj:
-                    # 用 project_name 与 repos 中的 id 做包含匹配
-                    for rid, api_ver in key_to_api.items():
-                        if rid and proj and rid in proj:
-                            rec['api_ver'] = api_ver
-                            matched += 1
-                            break
+def _init_worker(key_to_api: Dict[str, Any]) -> None:
+    global _worker_key_to_api, _worker_pattern
+    _worker_key_to_api = key_to_api
+    _worker_pattern = build_repo_id_pattern(key_to_api)
+
+
+def _process_range(task: Tuple[str, str, int, int, bool]) -> Tuple[int, int, int]:
+    """worker: 处理输入文件的一个字节区间，结果写入对应的分片文件。"""
+    input_jsonl, part_path, start, end, only_matched = task
+    with open(input_jsonl, 'rb', buffering=IO_BUFFER_SIZE) as fin, \
+            open(part_path, 'wb', buffering=IO_BUFFER_SIZE) as fout:
+        return _process_lines(_iter_range_lines(fin, start, end), fout, _worker_key_to_api, _worker_pattern,
+                              only_matched)
+
+
+def process_jsonl(input_jsonl: Path, output_jsonl: Path, key_to_api: Dict[str, Any],
+                  workers: int = 1, only_matched: bool = False) -> Tuple[int, int, int]:
+    """
+    读取 input_jsonl，匹配并补充 api_ver，写入 output_jsonl。
+    only_matched 为 True 时输出只包含本次新补充了 api_ver 的记录（统计口径不变）。
+    workers > 1 时按字节区间切分输入文件并行处理，最后按顺序拼接各分片，输出行序与串行一致。
+    返回 (total, matched, missing_api_ver_after)
+    """
+    # 确保输出目录存在
+    output_jsonl.parent.mkdir(parents=True, exist_ok=True)
 
-            # 统计仍无 api_ver 的记录
-            if 'api_ver' not in rec:
-                missing_after += 1
+    file_size = input_jsonl.stat().st_size
+    if workers <= 1 or file_size < workers * IO_BUFFER_SIZE:
+        pattern = build_repo_id_pattern(key_to_api)
+        # 二进制读写 + 1 MiB 缓冲，减少大文件上的 read/write 系统调用次数
+        with open(input_jsonl, 'rb', buffering=IO_BUFFER_SIZE) as fin, \
+                open(output_jsonl, 'wb', buffering=IO_BUFFER_SIZE) as fout:
+            return _process_lines(fin, fout, key_to_api, pattern, only_matched)
 
-            json.dump(rec, fout, ensure_ascii=False)
-            fout.write('\n')
+    chunk = -(-file_size // workers)
+    part_paths = [output_jsonl.with_name(f"{output_jsonl.name}.part{i}") for i in range(workers)]
+    tasks = [
+        (str(input_jsonl), str(part_paths[i]), i * chunk, min((i + 1) * chunk, file_size), only_matched)
+        for i in range(workers)
+    ]
+    try:
+        with Pool(processes=workers, initializer=_init_worker, initargs=(key_to_api,)) as pool:
+            results = pool.map(_process_range, tasks)
+        with open(output_jsonl, 'wb') as fout:
+            for part_path in part_paths:
+                with open(part_path, 'rb') as fpart:
+                    shutil.copyfileobj(fpart, fout, IO_BUFFER_SIZE)
+    finally:
+        for part_path in part_paths:
+            if part_path.exists():
+                part_path.unlink()
 
+    total = sum(r[0] for r in results)
+    matched = sum(r[1] for r in results)
+    missing_after = sum(r[2] for r in results)
     return total, matched, missing_after
 
 
@@ -97,6 +239,8 @@ def main():
     parser.add_argument('--repos-file', default=str(curdir / 'arkts_repos.json'), help='repos 文件路径')
     parser.add_argument('--input-jsonl', required=True, help='待补充的 JSONL 文件路径')
     parser.add_argument('--output-jsonl', help='输出 JSONL 文件路径（默认: 同目录追加 _with_api_ver 后缀）')
+    parser.add_argument('--workers', type=int, default=1, help='并行处理的进程数（默认: 1，即串行）')
+    parser.add_argument('--only-matched', action='store_true', help='只输出本次新补充了 api_ver 的记录')
     args = parser.parse_args()
 
     repos_file = Path(args.repos_file)
@@ -111,7 +255,8 @@ def main():
     key_to_api = load_repos_mapping(repos_file)
     print(f"加载 repos 映射数量: {len(key_to_api)}")
 
-    total, matched, missing_after = process_jsonl(input_jsonl, output_jsonl, key_to_api)
+    total, matched, missing_after = process_jsonl(input_jsonl, output_jsonl, key_to_api, workers=args.workers,
+                                                  only_matched=args.only_matched)
 
     print("\n=== 处理完成 ===")
     print(f"输入记录数: {total}")
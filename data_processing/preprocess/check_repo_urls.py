@@ -10,12 +10,19 @@
 """
 
 import os
+import re
+import sys
 import json
+import pickle
 import argparse
 from pathlib import Path
 from typing import Dict, Any, Set, Tuple, List
 
 
+# pickle 缓存格式版本：修改 git_url 归一化方式或缓存内容时递增，旧缓存（含无版本号的）会被重建
+GIT_URLS_CACHE_VERSION = 2
+
+
 def load_repo_git_urls(repos_file: Path) -> List[str]:
     """
     从 arkts_repos.json 加载 git_url 列表。
@@ -26,6 +33,16 @@ def load_repo_git_urls(repos_file: Path) -> List[str]:
     if not repos_file.exists():
         print(f"❌ repos 文件不存在: {repos_file}")
         return []
+    # 解析结果按 mtime 缓存为 pickle，repos 文件未变化时跳过 JSON 解析
+    mtime = repos_file.stat().st_mtime
+    cache_path = repos_file.with_suffix('.git_urls.pkl')
+    try:
+        with open(cache_path, 'rb') as f:
+            cached_version, cached_mtime, cached_urls = pickle.load(f)
+        if cached_version == GIT_URLS_CACHE_VERSION and cached_mtime == mtime:
+            return cached_urls
+    except Exception:
+        pass
     try:
         with open(repos_file, 'r', encoding='utf-8') as f:
             data = json.load(f)
@@ -36,6 +53,11 @@ def load_repo_git_urls(repos_file: Path) -> List[str]:
                 url = str(it.get('git_url', '') or '').strip()
                 if url:
                     urls.append(url)
+        try:
+            with open(cache_path, 'wb') as f:
+                pickle.dump((GIT_URLS_CACHE_VERSION, mtime, urls), f, protocol=pickle.HIGHEST_PROTOCOL)
+        except OSError:
+            pass
         return urls
     except Exception as e:
         print(f"❌ 读取 repos 文件失败: {e}")
@@ -61,15 +83,18 @@ def iter_jsonl_records(file_path: Path):
         print(f"❌ 读取文件失败 {file_path}: {e}")
 
 
-def analyze_file(jsonl_file: Path, repo_git_urls: List[str]) -> Tuple[int, int, Set[str], int]:
+def analyze_file(jsonl_file: Path, repo_git_urls: List[str]) -> Tuple[int, int, List[str], int]:
     """
     分析单个 JSONL 文件：
-    返回: (total_records, missing_repo_url_count, unmatched_project_names(去重), unmatched_count(未匹配记录条数))
+    返回: (total_records, missing_repo_url_count, unmatched_project_names(未去重, 由调用方汇总时去重), unmatched_count(未匹配记录条数))
     """
     total_records = 0
     missing_repo_url = 0
-    unmatched_project_names: Set[str] = set()
+    unmatched_project_names: List[str] = []
     unmatched_count = 0
+    # 以 '\x00' 拼接全部 git_url 并整体转小写一次，逐条记录只需对拼接串做一次查找，
+    # '\x00' 作为分隔符保证不会跨 URL 误匹配
+    repo_git_urls_concat = '\x00'.join(repo_git_urls).lower()
 
     for rec in iter_jsonl_records(jsonl_file):
         total_records += 1
@@ -78,27 +103,22 @@ def analyze_file(jsonl_file: Path, repo_git_urls: List[str]) -> Tuple[int, int,
         if not repo_url:
             missing_repo_url += 1
         # 2) project_name 与 git_url(包含匹配)，按 '-' 逐个替换尝试
-        project_name = str(rec.get('project_name') or '').strip()
+        # 驻留字符串：重复的 project_name 共享同一对象，集合去重时相等比较退化为指针比较
+        project_name = sys.intern(str(rec.get('project_name') or '').strip())
         if project_name:
-            matched = False
-            # 原始匹配
-            for url in repo_git_urls:
-                if url and project_name in url:
-                    matched = True
-                    break
-            # 逐个 '-' 替换为 '/' 再匹配
-            if not matched and '-' in project_name:
-                hyphen_positions = [i for i, ch in enumerate(project_name) if ch == '-']
-                for pos in hyphen_positions:
-                    alt_name = project_name[:pos] + '/' + project_name[pos+1:]
-                    for url in repo_git_urls:
-                        if url and alt_name in url:
-                            matched = True
-                            break
-                    if matched:
-                        break
+            proj_lc = project_name.lower()
+            # 原始匹配：在拼接串上做一次 C 层子串查找，替代逐 URL 的 Python 循环
+            matched = repo_git_urls_concat.find(proj_lc) != -1
+            # 逐个 '-' 替换为 '/' 再匹配：所有变体合成一个正则，对拼接串只扫描一次
+            if not matched and '-' in proj_lc:
+                variants = [
+                    proj_lc[:pos] + '/' + proj_lc[pos+1:]
+                    for pos, ch in enumerate(proj_lc) if ch == '-'
+                ]
+                pattern = re.compile('|'.join(re.escape(v) for v in variants))
+                matched = pattern.search(repo_git_urls_concat) is not None
             if not matched:
-                unmatched_project_names.add(project_name)
+                unmatched_project_names.append(project_name)
                 unmatched_count += 1
 
     return total_records, missing_repo_url, unmatched_project_names, unmatched_count
@@ -135,7 +155,9 @@ def main():
 
     for idx, fp in enumerate(jsonl_files, 1):
         print(f"\n📄 处理文件 {idx}/{len(jsonl_files)}: {fp.name}")
-        total, missing_cnt, unmatched_projects, unmatched_count = analyze_file(fp, repo_git_urls)
+        total, missing_cnt, unmatched_list, unmatched_count = analyze_file(fp, repo_git_urls)
+        # 逐文件只去重一次
+        unmatched_projects = set(unmatched_list)
 
         # 控制台打印每文件统计（不输出文件）
         print(f"   repoUrl 为空数量: {missing_cnt}")
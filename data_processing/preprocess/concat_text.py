@@ -11,13 +11,137 @@
 """
 
 import json
-import re
 import os
 import sys
+import argparse
 import hashlib
+import functools
+import mmap
+import shutil
 from pathlib import Path
-from typing import List, Dict, Tuple
-import argparse
+from typing import BinaryIO, Dict, Iterable, Iterator, List, Optional, Tuple, Union
+from concurrent.futures import ProcessPoolExecutor
+
+from config import LARGE_FILE_THRESHOLD, MIN_TEXT_LEN, VERBOSE_LOGGING
+
+# 优先使用 orjson 做 JSONL 解析与序列化，未安装时回退到标准库 json
+try:
+    import orjson
+    ORJSON_AVAILABLE = True
+except ImportError:
+    ORJSON_AVAILABLE = False
+
+# 解析一行JSON（str 或 bytes）：导入时直接绑定解析函数，逐行调用不再经过额外的包装与分支
+json_loads = orjson.loads if ORJSON_AVAILABLE else json.loads
+
+# BLAKE3 为可选的快速ID哈希算法
+try:
+    from blake3 import blake3
+    BLAKE3_AVAILABLE = True
+except ImportError:
+    BLAKE3_AVAILABLE = False
+
+# JSONL 读写缓冲区大小，同时作为输出批量写出的阈值
+IO_BUFFER_SIZE = 1 << 20
+
+# 单文件并行处理时每个切片的最小字节数，文件小于此值的两倍时串行处理
+PARALLEL_MIN_SPAN_SIZE = 16 << 20
+
+# 生成稳定ID所用的哈希算法：默认 sha256，与已产出数据的ID保持一致；新数据可切换为 blake3
+ID_HASH_ALGO = 'sha256'
+
+
+# Prompt格式输出是否保留原始 prompt/response 字段：下游只使用 text，默认丢弃以减少序列化和写盘量
+KEEP_PROMPT = False
+
+# Fields格式是否丢弃无效记录（缺少必需字段，或拼接后 text 短于 MIN_TEXT_LEN）：这些记录对训练无用，默认不写出
+DROP_INVALID = True
+
+
+# prompt / response 提取用的首尾锚点：均为"字面前缀 + 任意内容 + 字面后缀"，用 str.find 即可，无需正则
+_PROMPT_FIRST_MARKERS = ('The context above the method is:\n```arkts\n',
+                         '```\n\nAnd here is the code snippet you are asked to complete')
+_PROMPT_SECOND_MARKERS = ('And here is the code snippet you are asked to complete:\n```arkts\n',
+                          '```\n\nEnsure that only missing codes')
+_PROMPT_THIRD_MARKERS = ('The context below the method is:\n```arkts\n',
+                         '```\n\nThe context above the method is')
+_EXTERNAL_IMPORTED_MARKERS = ('Below are some information from external classes imported by current file:\n```arkts\n',
+                              '\n```')
+_RESPONSE_CODE_MARKERS = ('```arkts\n', '\n```')
+
+
+def set_id_hash_algo(algo: str) -> None:
+    """设置生成稳定ID所用的哈希算法（'sha256' 或 'blake3'）"""
+    global ID_HASH_ALGO
+    if algo == 'blake3' and not BLAKE3_AVAILABLE:
+        raise ValueError("blake3 不可用，请安装: pip install blake3")
+    ID_HASH_ALGO = algo
+
+
+def init_worker_options(id_hash_algo: str, keep_prompt: bool, drop_invalid: bool = True) -> None:
+    """进程池 initializer：把主进程的运行选项同步到 worker 进程"""
+    global KEEP_PROMPT, DROP_INVALID
+    set_id_hash_algo(id_hash_algo)
+    KEEP_PROMPT = keep_prompt
+    DROP_INVALID = drop_invalid
+
+
+def extract_between(text: str, markers: Tuple[str, str]) -> str:
+    """
+    提取 text 中第一个起始锚点与其后第一个结束锚点之间的内容（等价于非贪婪的 start(.*?)end）
+    
+    Args:
+        text: 待提取的字符串
+        markers: (起始锚点, 结束锚点)
+        
+    Returns:
+        锚点之间的内容，未找到时返回空字符串
+    """
+    start_marker, end_marker = markers
+    i = text.find(start_marker)
+    if i < 0:
+        return ""
+    i += len(start_marker)
+    j = text.find(end_marker, i)
+    if j < 0:
+        return ""
+    return text[i:j]
+
+
+def _join_str_items(value) -> str:
+    """列表或元组：为空返回空字符串；元素全为字符串时用换行符连接（保留每个元素的原始空格），否则转换为字符串"""
+    if len(value) == 0:
+        return ''
+    elif all(isinstance(item, str) for item in value):
+        return '\n'.join(item for item in value if item)  # 不使用strip()
+    else:
+        return str(value)
+
+
+def _dump_dict_body(value) -> str:
+    """字典：转换为JSON字符串并去除首尾的{}"""
+    # 保持 json.dumps 默认的 ", " / ": " 分隔符：text 是训练文本，不能改成 orjson 的紧凑格式；
+    # 字典序列化结果必然以 {} 包裹，直接切片即可
+    try:
+        return json.dumps(value, ensure_ascii=False)[1:-1]
+    except (TypeError, ValueError):
+        return str(value)
+
+
+# 按值的具体类型分派处理函数（JSON解析结果只会是这些精确类型），字符串保留原始空格，不使用strip()
+_FIELD_VALUE_HANDLERS = {
+    str: lambda value: value,
+    list: _join_str_items,
+    tuple: _join_str_items,
+    dict: _dump_dict_body,
+    type(None): lambda value: '',
+}
+
+
+def process_field_value(value) -> str:
+    """智能处理字段值，转换为合适的字符串，保留原始空格；其他类型直接转换为字符串"""
+    handler = _FIELD_VALUE_HANDLERS.get(type(value))
+    return handler(value) if handler is not None else str(value)
 
 
 def concatenate_fields(record: Dict) -> str:
@@ -30,48 +154,15 @@ def concatenate_fields(record: Dict) -> str:
     Returns:
         拼接后的text字符串
     """
-    # 获取三个字段的值，如果不存在则设为空字符串
-    above_functions = record.get('above_functions', '')
-    source_method_code = record.get('source_method_code', '')
-    below_functions = record.get('below_functions', '')
-    
-    # 智能处理字段值，转换为合适的字符串，保留原始空格
-    def process_field_value(value):
-        if value is None:
-            return ''
-        elif isinstance(value, str):
-            # 保留原始空格，不使用strip()
-            return value
-        elif isinstance(value, (list, tuple)):
-            # 如果是列表或元组，且为空，返回空字符串
-            if len(value) == 0:
-                return ''
-            # 如果列表包含字符串元素，用换行符连接，保留每个元素的原始空格
-            elif all(isinstance(item, str) for item in value):
-                return '\n'.join(item for item in value if item)  # 不使用strip()
-            # 其他情况，转换为字符串
-            else:
-                return str(value)
-        elif isinstance(value, dict):
-            # 如果是字典，转换为JSON字符串（去除首尾的{}）
-            try:
-                json_str = json.dumps(value, ensure_ascii=False)
-                return json_str[1:-1] if json_str.startswith('{') and json_str.endswith('}') else json_str
-            except:
-                return str(value)
-        else:
-            # 其他类型直接转换为字符串
-            return str(value)
-    
-    # 处理三个字段
-    above_functions = process_field_value(above_functions)
-    source_method_code = process_field_value(source_method_code)
-    below_functions = process_field_value(below_functions)
-    
-    # 直接拼接三个字段，保留原有的空格和换行
-    concatenated_text = above_functions + source_method_code + below_functions
-    
-    return concatenated_text
+    above_functions = record.get('above_functions')
+    source_method_code = record.get('source_method_code')
+    below_functions = record.get('below_functions')
+    # 绝大多数记录三个字段都是字符串，直接拼接，跳过逐字段的类型分派
+    if type(above_functions) is str and type(source_method_code) is str and type(below_functions) is str:
+        return above_functions + source_method_code + below_functions
+    
+    # 其余情况（list/dict/None）逐字段走通用处理后直接拼接，缺失字段与 None 一样按空字符串处理
+    return ''.join(map(process_field_value, (above_functions, source_method_code, below_functions)))
 
 
 def extract_text_from_prompt(prompt: str) -> str:
@@ -88,36 +179,20 @@ def extract_text_from_prompt(prompt: str) -> str:
         return ""
     
     try:
-        # 定义提取模式，保留前后空格
-        patterns = {
-            'first': r'The context above the method is:\n```arkts\n(.*?)```\n\nAnd here is the code snippet you are asked to complete',
-            'second': r'And here is the code snippet you are asked to complete:\n```arkts\n(.*?)```\n\nEnsure that only missing codes',
-            'third': r'The context below the method is:\n```arkts\n(.*?)```\n\nThe context above the method is'
-        }
-        
-        extracted_parts = {}
-        
-        # 提取三段内容，保留原有空格
-        for part_name, pattern in patterns.items():
-            match = re.search(pattern, prompt, re.DOTALL)
-            if match:
-                # 不使用strip()，保留原有空格
-                extracted_parts[part_name] = match.group(1)
-            else:
-                extracted_parts[part_name] = ""
+        # 提取三段内容，保留原有空格（不使用strip()）
+        first = extract_between(prompt, _PROMPT_FIRST_MARKERS)
+        second = extract_between(prompt, _PROMPT_SECOND_MARKERS)
+        third = extract_between(prompt, _PROMPT_THIRD_MARKERS)
         
         # 拼接三段内容，保持原有格式
-        combined_text = (
-            extracted_parts.get('first', '') + '\n\n' + 
-            extracted_parts.get('second', '') + '\n\n' + 
-            extracted_parts.get('third', '')
-        )
+        combined_text = '\n\n'.join((first, second, third))
         
         # 只在最后去除首尾的空白行，但保留内容中的空格
         return combined_text.rstrip('\n')
         
     except Exception as e:
-        print(f"提取过程中发生错误: {e}")
+        if VERBOSE_LOGGING:
+            print(f"提取过程中发生错误: {e}")
         return ""
 
 
@@ -135,18 +210,13 @@ def extract_external_imported(prompt: str) -> str:
         return ""
     
     try:
-        # 匹配 "Below are some information from external classes imported by current file:\n```arkts" 到 "```" 之间的内容
-        pattern = r'Below are some information from external classes imported by current file:\n```arkts\n(.*?)\n```'
-        match = re.search(pattern, prompt, re.DOTALL)
-        
-        if match:
-            # 保留原有空格，不使用strip()
-            return match.group(1)
-        else:
-            return ""
+        # 提取 "Below are some information from external classes imported by current file:\n```arkts" 到 "```" 之间的内容
+        # 保留原有空格，不使用strip()
+        return extract_between(prompt, _EXTERNAL_IMPORTED_MARKERS)
             
     except Exception as e:
-        print(f"提取external_imported时发生错误: {e}")
+        if VERBOSE_LOGGING:
+            print(f"提取external_imported时发生错误: {e}")
         return ""
 
 
@@ -164,18 +234,12 @@ def extract_response_code(response: str) -> str:
         return ""
     
     try:
-        # 匹配```arkts\n和\n```之间的内容
-        pattern = r'```arkts\n(.*?)\n```'
-        match = re.search(pattern, response, re.DOTALL)
-        
-        if match:
-            # 保留原有空格，不使用strip()
-            return match.group(1)
-        else:
-            return ""
+        # 提取```arkts\n和\n```之间的内容，保留原有空格，不使用strip()
+        return extract_between(response, _RESPONSE_CODE_MARKERS)
             
     except Exception as e:
-        print(f"提取response代码时发生错误: {e}")
+        if VERBOSE_LOGGING:
+            print(f"提取response代码时发生错误: {e}")
         return ""
 
 
@@ -203,10 +267,19 @@ def replace_unused98_tags(text: str, response_code: str) -> str:
         return replaced_text
         
     except Exception as e:
-        print(f"替换<unused98>标签时发生错误: {e}")
+        if VERBOSE_LOGGING:
+            print(f"替换<unused98>标签时发生错误: {e}")
         return text
 
 
+@functools.lru_cache(maxsize=1 << 16)
+def _hash_path(file_path: str, algo: str) -> str:
+    """对路径做哈希；同一文件的多个函数级记录共享 path，结果按 (path, 算法) 缓存"""
+    if algo == 'blake3':
+        return blake3(file_path.encode('utf-8')).hexdigest()
+    return hashlib.sha256(file_path.encode('utf-8')).hexdigest()
+
+
 def generate_stable_id(file_path: str) -> str:
     """
     基于文件路径生成稳定的ID
@@ -215,7 +288,7 @@ def generate_stable_id(file_path: str) -> str:
         file_path: 文件路径字符串
         
     Returns:
-        64位十六进制SHA256哈希ID
+        64位十六进制哈希ID（SHA256 或 BLAKE3，由 ID_HASH_ALGO 决定）
     """
     if not file_path or not isinstance(file_path, str):
         # 如果没有路径，生成一个随机ID
@@ -223,11 +296,12 @@ def generate_stable_id(file_path: str) -> str:
         return str(uuid.uuid4())
     
     try:
-        # 使用SHA256哈希生成稳定ID
-        stable_id = hashlib.sha256(file_path.encode('utf-8')).hexdigest()
+        # 使用SHA256（或BLAKE3）哈希生成稳定ID
+        stable_id = _hash_path(file_path, ID_HASH_ALGO)
         return stable_id
     except Exception as e:
-        print(f"生成ID时发生错误: {e}")
+        if VERBOSE_LOGGING:
+            print(f"生成ID时发生错误: {e}")
         # 出错时生成随机ID
         import uuid
         return str(uuid.uuid4())
@@ -261,7 +335,8 @@ def extract_project_info_from_repo_url(repo_url: str) -> tuple:
         else:
             return "", ""
     except Exception as e:
-        print(f"解析repoUrl时发生错误: {e}")
+        if VERBOSE_LOGGING:
+            print(f"解析repoUrl时发生错误: {e}")
         return "", ""
 
 
@@ -291,47 +366,53 @@ def detect_data_type(record: Dict) -> str:
         return 'fields'  # 默认返回fields
 
 
-def safe_json_loads(line: str, line_num: int) -> dict:
+def dump_jsonl_line(record: Dict) -> bytes:
     """
-    安全地解析JSON行，提供详细的错误信息
+    将记录序列化为一行UTF-8编码的JSONL（含结尾换行）
+    orjson 无法处理的值（如超出64位的整数）回退到标准库 json
+    """
+    if ORJSON_AVAILABLE:
+        try:
+            return orjson.dumps(record, option=orjson.OPT_APPEND_NEWLINE)
+        except TypeError:
+            pass
+    return (json.dumps(record, ensure_ascii=False) + '\n').encode('utf-8')
+
+
+def safe_json_loads(line: Union[str, bytes], line_num: int) -> dict:
+    """
+    安全地解析JSON行，失败时静默返回空字典，由调用方计数并汇总输出
     
     Args:
-        line: JSON字符串
+        line: JSON字符串（str 或未解码的 UTF-8 bytes）
         line_num: 行号（用于错误报告）
         
     Returns:
         解析后的字典，如果失败返回空字典
     """
     try:
-        return json.loads(line.strip())
-    except json.JSONDecodeError as e:
-        print(f"第 {line_num} 行JSON解析失败: {e}")
-        print(f"问题行内容: {line[:100]}...")  # 只显示前100个字符
-        return {}
-    except Exception as e:
-        print(f"第 {line_num} 行处理失败: {e}")
+        return json_loads(line)
+    except Exception:
         return {}
 
 
-def process_fields_record(record: Dict, record_index: int) -> Tuple[bool, Dict]:
+# Fields格式必需的三个字段
+_REQUIRED_FIELDS = frozenset(('above_functions', 'source_method_code', 'below_functions'))
+
+
+def process_fields_record(record: Dict, record_index: int, stats: dict) -> Optional[Dict]:
     """
     处理Fields格式的记录
     
     Args:
         record: 数据记录
         record_index: 记录索引（用于日志）
+        stats: 由 _new_file_stats() 创建的文件统计信息，原地累加，不再逐条创建统计字典
         
     Returns:
-        (是否成功, 统计信息)
+        待写出的记录；缺字段、拼接失败或text短于 MIN_TEXT_LEN 时返回None（DROP_INVALID 为 False 时
+        仍写出，缺字段或拼接失败时text为空），是否拼接成功见统计信息中的 fields_processed
     """
-    stats = {
-        'processed': 0,
-        'skipped': 0,
-        'missing_fields': 0,
-        'id_generated': 0,
-        'fields_renamed': 0
-    }
-    
     # 字段名标准化：将projectName改为project_name，将filePath改为path
     if 'projectName' in record:
         record['project_name'] = record.pop('projectName')
@@ -351,52 +432,47 @@ def process_fields_record(record: Dict, record_index: int) -> Tuple[bool, Dict]:
         stats['id_generated'] += 1
     
     # 检查是否包含所需的字段
-    required_fields = ['above_functions', 'source_method_code', 'below_functions']
-    missing_fields = [field for field in required_fields if field not in record]
+    missing_fields = _REQUIRED_FIELDS.difference(record)
     
     if missing_fields:
+        stats['fields_missing_fields'] += 1
+        if DROP_INVALID:
+            return None
         record['text'] = ""
-        stats['missing_fields'] += 1
-        return False, stats
+        return record
     
     # 拼接字段
     try:
         concatenated_text = concatenate_fields(record)
-        record['text'] = concatenated_text
-        stats['processed'] += 1
-        return True, stats
     except Exception as e:
+        if DROP_INVALID:
+            return None
         record['text'] = ""
-        stats['skipped'] += 1
-        return False, stats
+        return record
+    
+    record['text'] = concatenated_text
+    stats['fields_processed'] += 1
+    if DROP_INVALID and len(concatenated_text) < MIN_TEXT_LEN:
+        return None
+    return record
 
 
-def process_prompt_record(record: Dict, record_index: int) -> Tuple[bool, Dict]:
+def process_prompt_record(record: Dict, record_index: int, stats: dict) -> Optional[Dict]:
     """
     处理Prompt格式的记录
     
     Args:
         record: 数据记录
         record_index: 记录索引（用于日志）
+        stats: 由 _new_file_stats() 创建的文件统计信息，原地累加，不再逐条创建统计字典
         
     Returns:
-        (是否成功, 统计信息)
+        待写出的记录；缺少prompt、<unused98>替换失败或text为空时返回None，
+        成功处理（prompt_processed）与是否写出分开统计
     """
-    stats = {
-        'processed': 0,
-        'skipped': 0,
-        'unused98_replaced': 0,
-        'id_generated': 0,
-        'fields_renamed': 0,
-        'external_imported_extracted': 0,
-        'unused98_not_replaced': 0,
-        'unused98_not_replaced_ids': []
-    }
-    
     if 'prompt' not in record:
         record['text'] = ""
-        stats['skipped'] += 1
-        return False, stats
+        return None
     
     # 字段名标准化和字段值处理
     # 1. 处理projectName字段
@@ -428,24 +504,23 @@ def process_prompt_record(record: Dict, record_index: int) -> Tuple[bool, Dict]:
     # 生成基于path的稳定ID
     file_path = record.get('path', '')
     if file_path:
-        record['id'] = generate_stable_id(file_path)
-        stats['id_generated'] += 1
+        rid = generate_stable_id(file_path)
     else:
-        record['id'] = generate_stable_id("")
-        stats['id_generated'] += 1
+        rid = generate_stable_id("")
+    record['id'] = rid
+    stats['id_generated'] += 1
     
     # 提取text内容
-    text_content = extract_text_from_prompt(record['prompt'])
+    prompt = record['prompt']
+    text_content = extract_text_from_prompt(prompt)
     record['text'] = text_content
     
     # 提取external_imported内容
-    external_imported_content = extract_external_imported(record['prompt'])
+    external_imported_content = extract_external_imported(prompt)
     record['external_imported'] = external_imported_content
     if external_imported_content:  # 如果提取到内容，增加计数
         stats['external_imported_extracted'] += 1
     
-    stats['processed'] += 1
-    
     # 处理<unused98>标签替换
     replacement_failed = False
     if '<unused98>' in text_content:
@@ -454,85 +529,49 @@ def process_prompt_record(record: Dict, record_index: int) -> Tuple[bool, Dict]:
             if response_code:
                 replaced_text = replace_unused98_tags(text_content, response_code)
                 record['text'] = replaced_text
-                # 检查是否还有未替换的标签
-                if '<unused98>' in replaced_text:
+                # 检查是否还有未替换的标签：replace 已替换全部标签，剩余标签只可能来自 response 代码本身，
+                # 只需扫描较短的 response_code，无需再扫描整段替换后的文本
+                if '<unused98>' in response_code:
                     stats['unused98_not_replaced'] += 1
-                    stats['unused98_not_replaced_ids'].append(record.get('id', 'unknown'))
+                    stats['unused98_not_replaced_ids'].append(rid)
                     replacement_failed = True
-                    print(f"警告：记录ID {record.get('id', 'unknown')} 的<unused98>标签部分替换失败，仍有剩余标签")
                 else:
                     stats['unused98_replaced'] += 1
             else:
                 # response字段存在但无法提取代码，记录为未替换
                 stats['unused98_not_replaced'] += 1
-                stats['unused98_not_replaced_ids'].append(record.get('id', 'unknown'))
+                stats['unused98_not_replaced_ids'].append(rid)
                 replacement_failed = True
-                print(f"警告：记录ID {record.get('id', 'unknown')} 的response字段无法提取代码，<unused98>标签未替换")
         else:
             # 没有response字段，记录为未替换
             stats['unused98_not_replaced'] += 1
-            stats['unused98_not_replaced_ids'].append(record.get('id', 'unknown'))
+            stats['unused98_not_replaced_ids'].append(rid)
             replacement_failed = True
-            print(f"警告：记录ID {record.get('id', 'unknown')} 缺少response字段，<unused98>标签未替换")
     
     # 如果替换失败，跳过这条记录
     if replacement_failed:
-        return False, stats
+        return None
     
-    return True, stats
-
-
-def process_jsonl_file(input_file: str, output_dir: str, data_type: str) -> dict:
-    """
-    处理单个JSONL文件，使用指定的数据类型
+    stats['prompt_processed'] += 1
     
-    Args:
-        input_file: 输入JSONL文件路径
-        output_dir: 输出目录路径
-        data_type: 数据类型 ('fields' 或 'prompt')
-        
-    Returns:
-        处理统计信息字典
-    """
-    print(f"开始处理文件: {input_file}")
+    # text为空的记录不写出
+    if not record['text']:
+        return None
     
-    # 读取数据
-    try:
-        data = []
-        with open(input_file, 'r', encoding='utf-8') as f:
-            for line_num, line in enumerate(f, 1):
-                line = line.strip()
-                if not line:  # 跳过空行
-                    continue
-                
-                record = safe_json_loads(line, line_num)
-                if record:  # 只添加成功解析的记录
-                    data.append(record)
-                else:
-                    print(f"跳过第 {line_num} 行（解析失败）")
-        
-        print(f"成功读取 {len(data)} 条有效记录")
-        
-        if len(data) == 0:
-            print("没有成功解析任何记录，请检查文件格式")
-            return {
-                'total': 0,
-                'fields_processed': 0,
-                'prompt_processed': 0,
-                'skipped': 0,
-                'unknown_type': 0
-            }
-            
-    except FileNotFoundError:
-        print(f"❌ 文件不存在: {input_file}")
-        return {'total': 0, 'fields_processed': 0, 'prompt_processed': 0, 'skipped': 0, 'unknown_type': 0}
-    except Exception as e:
-        print(f"❌ 读取文件失败: {e}")
-        return {'total': 0, 'fields_processed': 0, 'prompt_processed': 0, 'skipped': 0, 'unknown_type': 0}
+    # 原始 prompt/response 已提取完毕，默认不写出
+    if not KEEP_PROMPT:
+        record.pop('prompt', None)
+        record.pop('response', None)
     
-    # 处理每条记录
-    stats = {
-        'total': len(data),
+    return record
+
+
+def _new_file_stats() -> dict:
+    """单个文件（或文件分片）的统计信息初始值"""
+    return {
+        'total': 0,
+        'saved': 0,
+        'parse_failed': 0,
         'fields_processed': 0,
         'prompt_processed': 0,
         'skipped': 0,
@@ -545,75 +584,224 @@ def process_jsonl_file(input_file: str, output_dir: str, data_type: str) -> dict
         'unused98_not_replaced': 0,
         'unused98_not_replaced_ids': []
     }
+
+
+# 视为空行直接跳过的原始行（含 read_bytes().split(b'\n') 产生的空串与 CRLF 残留）
+_BLANK_LINES = frozenset((b'', b'\n', b'\r', b'\r\n'))
+
+
+def _process_lines(lines: Iterable[bytes], f: BinaryIO, data_type: str, stats: dict) -> None:
+    """
+    逐行处理原始JSONL行并写出通过的记录，统计信息累加到 stats
     
-    for i, record in enumerate(data):
-        # 根据指定的数据类型处理记录
-        if data_type == 'fields':
-            success, record_stats = process_fields_record(record, i)
-            if success:
-                stats['fields_processed'] += 1
-            stats['fields_missing_fields'] += record_stats.get('missing_fields', 0)
-            stats['id_generated'] += record_stats.get('id_generated', 0)
-            stats['fields_renamed'] += record_stats.get('fields_renamed', 0)
+    Args:
+        lines: 原始JSONL行（bytes）
+        f: 以二进制打开的输出文件
+        data_type: 数据类型 ('fields' 或 'prompt')
+        stats: 由 _new_file_stats() 创建的统计信息字典
+    """
+    out_buf = bytearray()
+    # 数据类型在整个文件内不变，循环外判定一次，逐条记录只做布尔分支
+    is_fields = data_type == 'fields'
+    is_prompt = data_type == 'prompt'
+    
+    for line_num, line in enumerate(lines, 1):
+        # 跳过空行；非空行不做 strip 复制，行首尾空白由 JSON 解析器自行忽略
+        if line in _BLANK_LINES:
+            continue
+        
+        record = safe_json_loads(line, line_num)
+        if not record:  # 只处理成功解析的记录
+            # 解析失败时才 strip，纯空白行仍按空行跳过，不计入解析失败
+            if line.strip():
+                stats['parse_failed'] += 1
+            continue
+        
+        i = stats['total']
+        stats['total'] += 1
+        
+        # 根据指定的数据类型处理记录，返回待写出的记录（None 表示过滤掉）
+        if is_fields:
+            out_record = process_fields_record(record, i, stats)
             
-        elif data_type == 'prompt':
-            success, record_stats = process_prompt_record(record, i)
-            if success:
-                stats['prompt_processed'] += 1
-            stats['unused98_replaced'] += record_stats.get('unused98_replaced', 0)
-            stats['id_generated'] += record_stats.get('id_generated', 0)
-            stats['fields_renamed'] += record_stats.get('fields_renamed', 0)
-            stats['external_imported_extracted'] += record_stats.get('external_imported_extracted', 0)
-            stats['unused98_not_replaced'] += record_stats.get('unused98_not_replaced', 0)
-            stats['unused98_not_replaced_ids'].extend(record_stats.get('unused98_not_replaced_ids', []))
+        elif is_prompt:
+            out_record = process_prompt_record(record, i, stats)
             
         else:
+            # 其他类型，直接保存
             record['text'] = ""
             stats['unknown_type'] += 1
             stats['skipped'] += 1
+            out_record = record
         
-        if (i + 1) % 1000 == 0:
-            print(f"已处理 {i + 1}/{len(data)} 条记录")
+        if out_record is not None:
+            # 输出先追加到复用的 bytearray，累计约 1 MiB 再一次性写出，减少 write 调用次数
+            out_buf += dump_jsonl_line(out_record)
+            stats['saved'] += 1
+            if len(out_buf) >= IO_BUFFER_SIZE:
+                f.write(out_buf)
+                out_buf.clear()
+        
+        if stats['total'] % 1000 == 0:
+            print(f"已处理 {stats['total']} 条记录")
+    
+    if out_buf:
+        f.write(out_buf)
+
+
+def _iter_mmap_lines(mm: mmap.mmap, start: int, end: int) -> Iterator[bytes]:
+    """逐行产出 mmap 中 [start, end) 区间的行（start 须位于行首）"""
+    pos = start
+    while pos < end:
+        nl = mm.find(b'\n', pos, end)
+        if nl < 0:
+            nl = end
+        yield mm[pos:nl]
+        pos = nl + 1
+
+
+def _advise_sequential(fd: int) -> None:
+    """提示内核该输入文件将被顺序读取，加大预读；不支持 posix_fadvise 的平台直接跳过"""
+    if hasattr(os, 'posix_fadvise'):
+        try:
+            os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_SEQUENTIAL)
+        except OSError:
+            pass
+
+
+def _process_span(input_file: str, part_file: str, start: int, end: int, data_type: str) -> dict:
+    """进程池任务：处理输入文件 [start, end) 字节区间内的行，结果写入分片文件"""
+    stats = _new_file_stats()
+    with open(input_file, 'rb') as fin, open(part_file, 'wb', buffering=IO_BUFFER_SIZE) as f:
+        with mmap.mmap(fin.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            _process_lines(_iter_mmap_lines(mm, start, end), f, data_type, stats)
+    return stats
+
+
+def _split_line_aligned_spans(input_file: str, num_spans: int) -> List[Tuple[int, int]]:
+    """按字节均分文件，并将每个切分点对齐到下一行的行首"""
+    with open(input_file, 'rb') as fin:
+        with mmap.mmap(fin.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            size = len(mm)
+            bounds = [0]
+            for k in range(1, num_spans):
+                nl = mm.find(b'\n', max(bounds[-1], size * k // num_spans))
+                if nl < 0:
+                    break
+                bounds.append(nl + 1)
+            bounds.append(size)
+    return [(s, e) for s, e in zip(bounds, bounds[1:]) if s < e]
+
+
+def _process_jsonl_file_parallel(input_file: str, output_file: Path, data_type: str, workers: int) -> dict:
+    """将单个大文件按行对齐切片，多进程并行处理，再按原顺序拼接各分片输出"""
+    spans = _split_line_aligned_spans(input_file, workers)
+    part_files = [output_file.with_name(f"{output_file.name}.part{k}") for k in range(len(spans))]
+    stats = _new_file_stats()
+    try:
+        with ProcessPoolExecutor(max_workers=len(spans), initializer=init_worker_options,
+                                 initargs=(ID_HASH_ALGO, KEEP_PROMPT, DROP_INVALID)) as executor:
+            futures = [
+                executor.submit(_process_span, input_file, str(part_file), start, end, data_type)
+                for part_file, (start, end) in zip(part_files, spans)
+            ]
+            for future in futures:
+                for key, value in future.result().items():
+                    if isinstance(value, list):
+                        stats[key].extend(value)
+                    else:
+                        stats[key] += value
+        with open(output_file, 'wb', buffering=IO_BUFFER_SIZE) as f:
+            for part_file in part_files:
+                with open(part_file, 'rb') as fpart:
+                    shutil.copyfileobj(fpart, f, IO_BUFFER_SIZE)
+    finally:
+        for part_file in part_files:
+            part_file.unlink(missing_ok=True)
+    return stats
+
+
+def process_jsonl_file(input_file: str, output_dir: str, data_type: str, workers: int = 1,
+                       skip_existing: bool = False) -> dict:
+    """
+    处理单个JSONL文件，使用指定的数据类型
+    逐行流式处理：读取一条、处理一条、写出一条，内存占用与文件大小无关
+    workers > 1 且文件足够大时，按行对齐切片后多进程并行处理，输出顺序与串行一致
+    先写入同目录的 .tmp 临时文件，处理完成后再原子重命名为正式输出，中断时不会留下残缺的输出文件
     
+    Args:
+        input_file: 输入JSONL文件路径
+        output_dir: 输出目录路径
+        data_type: 数据类型 ('fields' 或 'prompt')
+        workers: 文件内并行的进程数（默认: 1，即串行）
+        skip_existing: 输出文件已存在时跳过该文件（用于中断后重跑）
+        
+    Returns:
+        处理统计信息字典
+    """
     # 生成输出文件名
     input_path = Path(input_file)
     base_name = input_path.stem
-    
-    # 保存处理后的数据（只保存成功处理的记录）
     output_file = Path(output_dir) / f"{base_name}_with_text.jsonl"
+    tmp_file = output_file.with_name(f"{output_file.name}.tmp")
+    
+    if skip_existing and output_file.exists():
+        print(f"⏭️  输出已存在，跳过: {input_file}")
+        return _new_file_stats()
+    
+    print(f"开始处理文件: {input_file}")
+    
+    # 读取、处理并保存数据（只保存成功处理的记录）
+    stats = _new_file_stats()
     try:
-        saved_count = 0
-        with open(output_file, 'w', encoding='utf-8') as f:
-            for record in data:
-                # 检查记录是否成功处理（有text字段且不为空，或者没有<unused98>标签）
-                if data_type == 'prompt':
-                    # prompt格式：需要有text字段，且如果原本有<unused98>标签则必须成功替换
-                    if 'text' in record and record['text']:
-                        # 如果text中仍有<unused98>标签，说明替换失败，跳过
-                        if '<unused98>' not in record['text']:
-                            json.dump(record, f, ensure_ascii=False)
-                            f.write('\n')
-                            saved_count += 1
-                elif data_type == 'fields':
-                    # fields格式：有text字段即可
-                    if 'text' in record:
-                        json.dump(record, f, ensure_ascii=False)
-                        f.write('\n')
-                        saved_count += 1
-                else:
-                    # 其他类型，直接保存
-                    json.dump(record, f, ensure_ascii=False)
-                    f.write('\n')
-                    saved_count += 1
-        
-        print(f"✅ 处理后的数据已保存到: {output_file}")
-        print(f"✅ 实际保存记录数: {saved_count}/{len(data)}")
-        if saved_count < len(data):
-            print(f"⚠️  过滤掉了 {len(data) - saved_count} 条替换失败的记录")
+        file_size = os.path.getsize(input_file)
+        workers = min(workers, file_size // PARALLEL_MIN_SPAN_SIZE)
+        if workers > 1:
+            print(f"文件较大，使用 {workers} 个进程并行处理")
+            stats = _process_jsonl_file_parallel(input_file, tmp_file, data_type, workers)
+        elif file_size < LARGE_FILE_THRESHOLD:
+            # 中小文件：一次性读入内存后按行切分，省去逐行缓冲读取
+            lines = Path(input_file).read_bytes().split(b'\n')
+            with open(tmp_file, 'wb', buffering=IO_BUFFER_SIZE) as f:
+                _process_lines(lines, f, data_type, stats)
+        else:
+            # 以二进制读取，bytes 直接交给 JSON 解析器，省去逐行 UTF-8 解码为 str 的开销
+            with open(input_file, 'rb', buffering=IO_BUFFER_SIZE) as fin, \
+                    open(tmp_file, 'wb', buffering=IO_BUFFER_SIZE) as f:
+                _advise_sequential(fin.fileno())
+                _process_lines(fin, f, data_type, stats)
+    
+    except FileNotFoundError:
+        tmp_file.unlink(missing_ok=True)
+        print(f"❌ 文件不存在: {input_file}")
+        return {'total': 0, 'fields_processed': 0, 'prompt_processed': 0, 'skipped': 0, 'unknown_type': 0}
     except Exception as e:
-        print(f"❌ 保存文件失败: {e}")
+        tmp_file.unlink(missing_ok=True)
+        print(f"❌ 处理文件失败: {e}")
         return stats
     
+    print(f"成功读取 {stats['total']} 条有效记录")
+    if stats['parse_failed'] > 0:
+        print(f"⚠️  跳过 {stats['parse_failed']} 行（JSON解析失败）")
+    
+    if stats['total'] == 0:
+        print("没有成功解析任何记录，请检查文件格式")
+        tmp_file.unlink(missing_ok=True)
+        return {
+            'total': 0,
+            'fields_processed': 0,
+            'prompt_processed': 0,
+            'skipped': 0,
+            'unknown_type': 0
+        }
+    
+    os.replace(tmp_file, output_file)
+    saved_count = stats['saved']
+    print(f"✅ 处理后的数据已保存到: {output_file}")
+    print(f"✅ 实际保存记录数: {saved_count}/{stats['total']}")
+    if saved_count < stats['total']:
+        print(f"⚠️  过滤掉了 {stats['total'] - saved_count} 条无效记录（标签替换失败、缺少字段或text过短）")
+    
     # 输出统计信息
     print(f"\n🎯 处理完成！")
     print(f"总记录数: {stats['total']}")
@@ -648,18 +836,16 @@ def get_jsonl_files(input_dir: str) -> List[str]:
     jsonl_files = []
     
     try:
-        input_path = Path(input_dir)
-        if not input_path.exists():
+        if not os.path.exists(input_dir):
             print(f"❌ 输入目录不存在: {input_dir}")
             return jsonl_files
         
-        # 查找所有.jsonl文件
-        for file_path in input_path.glob("*.jsonl"):
-            jsonl_files.append(str(file_path))
-        
-        # 也查找.json文件（如果有的话）
-        for file_path in input_path.glob("*.json"):
-            jsonl_files.append(str(file_path))
+        # 单次扫描目录，同时查找.jsonl和.json文件
+        with os.scandir(input_dir) as it:
+            for entry in it:
+                if entry.name.endswith(('.jsonl', '.json')) and entry.is_file():
+                    jsonl_files.append(entry.path)
+        jsonl_files.sort()
         
         print(f"在 {input_dir} 目录下找到 {len(jsonl_files)} 个JSONL文件")
         
@@ -669,14 +855,18 @@ def get_jsonl_files(input_dir: str) -> List[str]:
     return jsonl_files
 
 
-def batch_process_directory(input_dir: str, output_dir: str, data_type: str) -> dict:
+def batch_process_directory(input_dir: str, output_dir: str, data_type: str,
+                            max_workers: Optional[int] = None, skip_existing: bool = False) -> dict:
     """
     批量处理指定目录下的所有JSONL文件
+    各文件相互独立（输出文件不同），多进程并行处理
     
     Args:
         input_dir: 输入目录路径
         output_dir: 输出目录路径
         data_type: 数据类型 ('fields' 或 'prompt')
+        max_workers: 并行进程数（默认: CPU核数；为1时串行处理）
+        skip_existing: 跳过输出文件已存在的输入文件（用于中断后重跑）
         
     Returns:
         总体统计信息
@@ -713,12 +903,30 @@ def batch_process_directory(input_dir: str, output_dir: str, data_type: str) ->
         'total_unused98_not_replaced_ids': []
     }
     
-    for i, input_file in enumerate(jsonl_files, 1):
-        print(f"\n📁 处理文件 {i}/{len(jsonl_files)}: {os.path.basename(input_file)}")
-        
-        # 处理文件
-        stats = process_jsonl_file(input_file, output_dir, data_type)
-        
+    if max_workers is None:
+        max_workers = os.cpu_count() or 1
+    # 只有一个文件时无法按文件并行，把进程数交给文件内切片并行
+    span_workers = max_workers if len(jsonl_files) == 1 else 1
+    max_workers = min(max_workers, len(jsonl_files))
+    
+    if max_workers <= 1:
+        def iter_file_stats():
+            for i, input_file in enumerate(jsonl_files, 1):
+                print(f"\n📁 处理文件 {i}/{len(jsonl_files)}: {os.path.basename(input_file)}")
+                yield input_file, process_jsonl_file(input_file, output_dir, data_type, workers=span_workers,
+                                                     skip_existing=skip_existing)
+    else:
+        def iter_file_stats():
+            print(f"使用 {max_workers} 个进程并行处理 {len(jsonl_files)} 个文件")
+            with ProcessPoolExecutor(max_workers=max_workers, initializer=init_worker_options,
+                                     initargs=(ID_HASH_ALGO, KEEP_PROMPT, DROP_INVALID)) as executor:
+                # executor.map 按提交顺序返回结果，汇总统计（如失败ID列表）的顺序与串行处理一致
+                n = len(jsonl_files)
+                results = executor.map(process_jsonl_file, jsonl_files, [output_dir] * n, [data_type] * n,
+                                       [1] * n, [skip_existing] * n)
+                yield from zip(jsonl_files, results)
+    
+    for input_file, stats in iter_file_stats():
         # 累计统计信息
         total_stats['total_records'] += stats['total']
         total_stats['total_fields_processed'] += stats['fields_processed']
@@ -765,8 +973,32 @@ def main():
     parser.add_argument('--force-type', choices=['fields', 'prompt'],
                        help='强制指定数据类型，跳过自动检测')
     
+    # 稳定ID哈希算法
+    parser.add_argument('--id-hash', choices=['sha256', 'blake3'], default='sha256',
+                       help='生成稳定ID的哈希算法（默认: sha256，与已有数据兼容；blake3 更快，需要 pip install blake3）')
+    
+    # 是否保留原始prompt/response字段
+    parser.add_argument('--keep-prompt', action='store_true',
+                       help='Prompt格式输出中保留原始 prompt/response 字段（默认丢弃）')
+    
+    # 并行进程数
+    parser.add_argument('--workers', type=int, default=None,
+                       help='并行进程数：批量处理时按文件并行，--single-file 时按文件内切片并行（默认: CPU核数；1 表示串行）')
+    
+    # 是否保留无效的Fields格式记录
+    parser.add_argument('--keep-invalid', action='store_true',
+                       help='Fields格式输出中保留缺少字段或text过短的记录（默认丢弃）')
+    
+    # 断点续跑
+    parser.add_argument('--skip-existing', action='store_true',
+                       help='跳过输出文件已存在的输入文件（中断后重跑时只处理未完成的文件）')
+    
     args = parser.parse_args()
     
+    if args.id_hash == 'blake3' and not BLAKE3_AVAILABLE:
+        parser.error("--id-hash blake3 需要安装 blake3: pip install blake3")
+    init_worker_options(args.id_hash, args.keep_prompt, not args.keep_invalid)
+    
     # 获取当前脚本所在目录
     curdir = os.path.dirname(__file__)
     
@@ -805,7 +1037,9 @@ def main():
                 print(f"检测文件类型失败: {e}，默认使用fields类型")
                 file_data_type = 'fields'
         
-        stats = process_jsonl_file(args.single_file, str(output_dir), file_data_type)
+        # 单个大文件：文件内按行切片并行处理
+        stats = process_jsonl_file(args.single_file, str(output_dir), file_data_type,
+                                   workers=args.workers or os.cpu_count() or 1, skip_existing=args.skip_existing)
         return
     
     # 确定处理模式
@@ -828,7 +1062,8 @@ def main():
         
         if fields_dir.exists():
             print(f"\n🔧 处理Fields格式数据 (来源: {fields_dir})")
-            fields_stats = batch_process_directory(str(fields_dir), str(output_dir), 'fields')
+            fields_stats = batch_process_directory(str(fields_dir), str(output_dir), 'fields', args.workers,
+                                                   skip_existing=args.skip_existing)
             
             # 累计统计
             overall_stats['total_files'] += fields_stats['total_files']
@@ -846,7 +1081,8 @@ def main():
         
         if prompt_dir.exists():
             print(f"\n🔧 处理Prompt格式数据 (来源: {prompt_dir})")
-            prompt_stats = batch_process_directory(str(prompt_dir), str(output_dir), 'prompt')
+            prompt_stats = batch_process_directory(str(prompt_dir), str(output_dir), 'prompt', args.workers,
+                                                   skip_existing=args.skip_existing)
             
             # 累计统计
             overall_stats['total_files'] += prompt_stats['total_files']
@@ -14,6 +14,9 @@ BATCH_SIZE = 500  # 可以根据内存情况调整
 # 文件大小阈值（超过此大小启用分批处理）
 LARGE_FILE_THRESHOLD = 100 * 1024 * 1024  # 100MB
 
+# 输出文本最小长度（字符数），Fields格式拼接后短于此长度的记录不写出（concat_text.py --keep-invalid 可保留）
+MIN_TEXT_LEN = 1
+
 # 进度显示频率
 PROGRESS_DISPLAY_INTERVAL = 5  # 每处理多少个批次显示一次进度
 
@@ -23,16 +23,35 @@ Usage (sample X% to FIM and mix with original for multiple files):
     --output_dir out_dir \
     --min_middle_chars 80 --max_middle_chars 1200 --seed 42
 """
-import json, re, random, argparse, sys
+import json, re, random, argparse, sys, heapq
+from collections import deque
+from itertools import accumulate, islice
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
 
 from tree_sitter import Language, Parser
 import tree_sitter_typescript as tst
 
+# Prefer orjson for JSONL parsing/serialization; fall back to stdlib json when not installed
+try:
+    import orjson
+    ORJSON_AVAILABLE = True
+except ImportError:
+    ORJSON_AVAILABLE = False
+
+json_loads = orjson.loads if ORJSON_AVAILABLE else json.loads
+
 FIM_PREFIX = "<|fim_prefix|>"
 FIM_SUFFIX = "<|fim_suffix|>"
 FIM_MIDDLE = "<|fim_middle|>"
 
+# Output JSONL lines are batched in memory and written in chunks of this size
+IO_BUFFER_SIZE = 1 << 20
+
+# With --workers > 1, input is split into chunks of this many lines/items; each chunk
+# gets its own RNG seeded from (seed, chunk index), so output does not depend on worker count
+FIM_CHUNK_SIZE = 1000
+
 # ---------- Tree-sitter initialization (TS/ArkTS reuses TypeScript grammar) ----------
 tree_sitter_language = Language(tst.language_typescript())
 parser = Parser()
@@ -40,6 +59,7 @@ parser.language = tree_sitter_language
 
 # ---------- Utilities ----------
 IDENT_RE = re.compile(r"[A-Za-z_]\w+")
+NON_SPACE_RE = re.compile(r"\S")
 
 def safe_slice(s, start, end):
     start = max(0, min(len(s), start))
@@ -47,46 +67,91 @@ def safe_slice(s, start, end):
     if start > end: start, end = end, start
     return s[start:end], start, end
 
-def choose_span_by_lines(code, min_chars, max_chars, seed):
+def not_all_space(s, start, end):
+    """Same as `not s[start:end].isspace()`, but stops at the first non-whitespace char without copying the slice."""
+    return start >= end or NON_SPACE_RE.search(s, start, end) is not None
+
+def dump_jsonl_line(obj):
+    """Serialize one record to a UTF-8 JSONL line (bytes, with trailing newline)."""
+    if ORJSON_AVAILABLE:
+        try:
+            return orjson.dumps(obj, option=orjson.OPT_APPEND_NEWLINE)
+        except TypeError:
+            # orjson rejects e.g. integers wider than 64 bits and lone surrogates; use stdlib json
+            pass
+    try:
+        return (json.dumps(obj, ensure_ascii=False) + "\n").encode("utf-8")
+    except UnicodeEncodeError:
+        # lone surrogates cannot be encoded as UTF-8; write them as \uXXXX escapes instead
+        return (json.dumps(obj) + "\n").encode("ascii")
+
+def iter_jsonl_lines(path):
+    """Yield raw JSONL lines (bytes, trailing newline kept), read through an IO_BUFFER_SIZE buffer."""
+    # buffered line iteration splits lines in C and copies a long record only once; the
+    # newline is left in place (the JSON parsers accept it) so no second copy is made
+    with Path(path).open("rb", buffering=IO_BUFFER_SIZE) as fin:
+        yield from fin
+
+def load_jsonl_object(line):
+    """Parse one raw JSONL line into a dict; None for blank, malformed or non-object lines."""
+    # records are JSON objects: anything not starting with "{" (blank lines included) is
+    # skipped without entering the parser or raising
+    if line[:1] != b"{" and not line.lstrip().startswith(b"{"):
+        return None
+    try:
+        return json_loads(line)
+    except ValueError:
+        # orjson.JSONDecodeError / json.JSONDecodeError / invalid UTF-8 are all ValueErrors
+        return None
+
+def choose_span_by_lines(code, min_chars, max_chars, rnd):
     lines = code.splitlines(keepends=True)
     if len(lines) < 6: return None
-    rnd = random.Random(seed)
+    # char offset of each line start (plus the end), computed once for all retries
+    cumlens = list(accumulate((len(x) for x in lines), initial=0))
     for _ in range(30):
         L = rnd.randint(2, min(20, max(2, len(lines)//3)))
         i = rnd.randint(0, max(0, len(lines)-L))
-        mid = "".join(lines[i:i+L])
-        if min_chars <= len(mid) <= max_chars and not mid.isspace():
-            # compute char offsets
-            start = sum(len(x) for x in lines[:i])
-            end = start + len(mid)
+        start, end = cumlens[i], cumlens[i+L]
+        if min_chars <= end - start <= max_chars and not_all_space(code, start, end):
             return (start, end)
     return None
 
-def tree_nodes(root, types):
+# bytes.translate table mapping UTF-8 continuation bytes (0b10xxxxxx) to 1, all others to 0
+_UTF8_CONT_TABLE = bytes(1 if (b & 0xC0) == 0x80 else 0 for b in range(256))
+
+# AST node types for functions, and for the body block found among a function's direct children
+FUNC_TYPES = frozenset({"function_declaration", "method_definition", "function"})
+BLOCK_TYPES = frozenset({"statement_block", "block"})
+
+def function_bodies(root):
+    """Body nodes of all functions under `root`, found in a single DFS (functions without a body are skipped)."""
+    bodies = []
     stack = [root]
     while stack:
         n = stack.pop()
-        if n.type in types:
-            yield n
-        for c in n.children:
-            stack.append(c)
-
-def choose_span_by_function_block(code, min_chars, max_chars, seed):
-    tree = parser.parse(code.encode("utf-8"))
+        children = n.children
+        if n.type in FUNC_TYPES:
+            # the function's body is its first block child; peek while its children are at hand
+            for c in children:
+                if c.type in BLOCK_TYPES:
+                    bodies.append(c)
+                    break
+        stack.extend(children)
+    return bodies
+
+def choose_span_by_function_block(code, min_chars, max_chars, rnd, tree=None):
+    # encode once; tree-sitter offsets are byte offsets into this buffer
+    buf = code.encode("utf-8")
+    # callers retrying on the same text can pass its parse tree to skip re-parsing
+    if tree is None:
+        tree = parser.parse(buf)
     root = tree.root_node
-    func_types = {"function_declaration", "method_definition", "function"}
-    block_types = {"statement_block", "block"}
-    rnd = random.Random(seed)
+    # byte -> char offsets: for ASCII-only code they coincide; otherwise count UTF-8
+    # continuation bytes (mapped to 1 once per text) in C via bytes.count
+    cont = None if len(buf) == len(code) else buf.translate(_UTF8_CONT_TABLE)
     candidates = []
-    for f in tree_nodes(root, func_types):
-        # find function body
-        body = None
-        for c in f.children:
-            if c.type in block_types:
-                body = c
-                break
-        if not body: 
-            continue
+    for body in function_bodies(root):
         # sample one contiguous span inside the function body
         start, end = body.start_byte, body.end_byte
         if end - start < min_chars: 
@@ -96,10 +161,14 @@ def choose_span_by_function_block(code, min_chars, max_chars, seed):
             L = rnd.randint(min_chars, min(max_chars, max(min_chars, (end-start)//2)))
             a = rnd.randint(start, max(start, end-L))
             b = a + L
-            seg = code.encode("utf-8")[a:b].decode("utf-8", errors="ignore")
+            seg = buf[a:b].decode("utf-8", errors="ignore")
             if not seg.isspace():
-                # map back to char indices (approximate at UTF-8 boundaries)
-                s = len(code.encode("utf-8")[:a].decode("utf-8", errors="ignore"))
+                # map back to char indices; a byte offset inside a multi-byte char maps to that
+                # char's own index, the length of the errors="ignore" decode of buf[:a] it replaces
+                if cont is None:
+                    s = a
+                else:
+                    s = a - cont.count(1, 0, a) - (a < len(cont) and cont[a])
                 e = s + len(seg)
                 candidates.append((s, e))
                 break
@@ -107,19 +176,26 @@ def choose_span_by_function_block(code, min_chars, max_chars, seed):
         return None
     return rnd.choice(candidates)
 
-def choose_span_by_identifier(code, min_chars, max_chars, seed):
+def choose_span_by_identifier(code, min_chars, max_chars, rnd):
     # pick a frequent identifier, then expand around nearby occurrences to form a span
-    rnd = random.Random(seed)
-    idents = IDENT_RE.findall(code)
-    if not idents: 
+    # single scan: bucket occurrence start offsets by identifier (dict keeps first-seen order);
+    # ends are implied by the identifier length, so only ints are stored per occurrence
+    starts_by_ident = {}
+    for m in IDENT_RE.finditer(code):
+        starts_by_ident.setdefault(m.group(), []).append(m.start())
+    if not starts_by_ident: 
         return None
-    # sort by frequency
-    from collections import Counter
-    cand = [w for w,c in Counter(idents).most_common(30) if len(w)>1 and not w.isupper()]
+    # 30 most frequent, via partial selection instead of a full sort (ties keep first-seen order)
+    ranked = heapq.nlargest(30, starts_by_ident.items(), key=lambda kv: len(kv[1]))
+    cand = [w for w, _ in ranked if len(w)>1 and not w.isupper()]
     if not cand: 
         return None
     target = rnd.choice(cand[:10])
-    spans = [m.span() for m in re.finditer(rf"\b{re.escape(target)}\b", code)]
+    n = len(target)
+    # keep whole-word occurrences only (same as matching \btarget\b): an identifier
+    # match can follow a digit or non-ASCII word char, which is not a word boundary
+    spans = [(a, a + n) for a in starts_by_ident[target]
+             if a == 0 or not (code[a-1].isalnum() or code[a-1] == "_")]
     if len(spans) < 3: 
         return None
     # choose a central occurrence and expand a few occurrences to both sides to form a contiguous span
@@ -135,24 +211,27 @@ def choose_span_by_identifier(code, min_chars, max_chars, seed):
         return (start, end)
     return None
 
-def choose_span_by_tokens(code, min_chars, max_chars, seed):
-    rnd = random.Random(seed)
+def choose_span_by_tokens(code, min_chars, max_chars, rnd):
     if len(code) < min_chars: 
         return None
     for _ in range(20):
         L = rnd.randint(min_chars, min(max_chars, max(min_chars, len(code)//3)))
         a = rnd.randint(0, max(0, len(code)-L))
         b = a + L
-        if not code[a:b].isspace():
+        if not_all_space(code, a, b):
             return (a, b)
     return None
 
+def build_fim_text(code, span):
+    """FIM-annotated string for `code` with `span` as the middle (the `text` of build_fim_record)."""
+    s, e = span
+    return "".join((FIM_PREFIX, code[:s], FIM_SUFFIX, code[e:], FIM_MIDDLE, code[s:e]))
+
 def build_fim_record(code, span):
     s, e = span
-    prefix, _, _ = safe_slice(code, 0, s)
-    middle, _, _ = safe_slice(code, s, e)
-    suffix, _, _ = safe_slice(code, e, len(code))
-    fim_text = f"{FIM_PREFIX}{prefix}{FIM_SUFFIX}{suffix}{FIM_MIDDLE}{middle}"
+    # spans from pick_span are already ordered and within bounds
+    prefix, middle, suffix = code[:s], code[s:e], code[e:]
+    fim_text = "".join((FIM_PREFIX, prefix, FIM_SUFFIX, suffix, FIM_MIDDLE, middle))
     return {
         "text": fim_text,
         "meta": {
@@ -163,21 +242,135 @@ def build_fim_record(code, span):
         }
     }
 
-def pick_span(code, strategy, min_chars, max_chars, seed):
+def pick_span(code, strategy, min_chars, max_chars, rnd, tree=None):
+    """Pick a (start, end) char span with the given strategy, drawing from the caller's random.Random.
+
+    `tree` is an optional tree-sitter parse of `code`, reused by the function strategy.
+    """
     if strategy == "function":
-        return choose_span_by_function_block(code, min_chars, max_chars, seed)
+        return choose_span_by_function_block(code, min_chars, max_chars, rnd, tree)
     if strategy == "line":
-        return choose_span_by_lines(code, min_chars, max_chars, seed)
+        return choose_span_by_lines(code, min_chars, max_chars, rnd)
     if strategy == "identifier":
-        return choose_span_by_identifier(code, min_chars, max_chars, seed)
+        return choose_span_by_identifier(code, min_chars, max_chars, rnd)
     if strategy == "token":
-        return choose_span_by_tokens(code, min_chars, max_chars, seed)
+        return choose_span_by_tokens(code, min_chars, max_chars, rnd)
+    return None
+
+def choose_strategy(probs, rng):
+    """Draw a span strategy name from normalized (name, probability) pairs."""
+    r = rng.random()
+    acc = 0.0
+    for k, p in probs:
+        acc += p
+        if r <= acc:
+            return k
+    return probs[-1][0] if probs else "token"
+
+def eval_record_line(obj, rng, probs, min_middle_chars, max_middle_chars):
+    """Build one serialized FIM eval line from a parsed input object, or None if no span fits."""
+    base_text = obj.get("text") or obj.get("code") or ""
+    lf = obj.get("llm_formatted")
+    # resolve llm_formatted text if present
+    if isinstance(lf, str):
+        llm_text = lf
+    elif isinstance(lf, dict):
+        llm_text = lf.get("text") or ""
+    else:
+        llm_text = ""
+
+    # choose a single candidate: prefer llm_formatted if the field exists in the object; otherwise use base text
+    selected = llm_text if ("llm_formatted" in obj) else base_text
+
+    # skip if selected is empty or too short to build a valid FIM span
+    if not selected or len(selected) < (min_middle_chars + 10):
+        return None
+
+    # pick strategy
+    strategy = choose_strategy(probs, rng)
+    # select span
+    span = pick_span(selected, strategy, min_middle_chars, max_middle_chars, rng)
+    if not span:
+        return None
+    rec = build_fim_record(selected, span)
+    rec["meta"]["strategy"] = strategy
+    return dump_jsonl_line(rec)
+
+def _iter_eval_records(lines, rng, probs, min_middle_chars, max_middle_chars):
+    for line in lines:
+        obj = load_jsonl_object(line)
+        if obj is None:
+            continue
+        out = eval_record_line(obj, rng, probs, min_middle_chars, max_middle_chars)
+        if out is not None:
+            yield out
+
+def _eval_records_for_chunk(chunk_seed, lines, probs, min_middle_chars, max_middle_chars):
+    """Worker: build FIM eval lines for one chunk of raw input lines."""
+    rng = random.Random(chunk_seed)
+    return list(_iter_eval_records(lines, rng, probs, min_middle_chars, max_middle_chars))
+
+def iter_chunks(iterable, size):
+    """Yield consecutive lists of up to `size` items."""
+    chunk = []
+    for x in iterable:
+        chunk.append(x)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+def imap_ordered(executor, fn, tasks, max_pending):
+    """Like executor.map, but keeps at most max_pending tasks in flight so input is consumed lazily."""
+    pending = deque()
+    for args in tasks:
+        pending.append(executor.submit(fn, *args))
+        if len(pending) >= max_pending:
+            yield pending.popleft().result()
+    while pending:
+        yield pending.popleft().result()
+
+def _iter_eval_records_parallel(in_path, workers, seed, probs, min_middle_chars, max_middle_chars):
+    tasks = ((seed ^ k, chunk, probs, min_middle_chars, max_middle_chars)
+             for k, chunk in enumerate(iter_chunks(iter_jsonl_lines(in_path), FIM_CHUNK_SIZE)))
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        for lines in imap_ordered(executor, _eval_records_for_chunk, tasks, workers * 2):
+            yield from lines
+
+def fim_text_for(text, rng, probs, min_middle_chars, max_middle_chars):
+    """Try up to 12 strategy draws to turn `text` into a FIM string; None if it is too short or no span fits."""
+    if not text or len(text) < (min_middle_chars + 10):
+        return None
+    tree = None
+    for _ in range(12):
+        strategy = choose_strategy(probs, rng)
+        # parse lazily, at most once per text, however many function draws it takes
+        if strategy == "function" and tree is None:
+            tree = parser.parse(text.encode("utf-8"))
+        span = pick_span(text, strategy, min_middle_chars, max_middle_chars, rng, tree)
+        if span:
+            return build_fim_text(text, span)
     return None
 
+def fim_texts_for_pairs(pairs, rng, probs, min_middle_chars, max_middle_chars):
+    """FIM texts for (base_text, llm_text) pairs, base before llm_formatted, in input order."""
+    fim_list = []
+    for base_text, llm_text in pairs:
+        for text in (base_text, llm_text):
+            rec_text = fim_text_for(text, rng, probs, min_middle_chars, max_middle_chars)
+            if rec_text:
+                fim_list.append(rec_text)
+    return fim_list
+
+def _fim_texts_for_chunk(chunk_seed, pairs, probs, min_middle_chars, max_middle_chars):
+    """Worker: FIM texts for one chunk of selected (base_text, llm_text) pairs."""
+    return fim_texts_for_pairs(pairs, random.Random(chunk_seed), probs, min_middle_chars, max_middle_chars)
+
 def make_fim_dataset(input_path, output_path, samples=2000, 
                      min_middle_chars=80, max_middle_chars=1200, 
                      seed=42, p_function=0.4, p_line=0.3, 
-                     p_identifier=0.2, p_token=0.1):
+                     p_identifier=0.2, p_token=0.1, workers=1):
     """
     Convert raw JSONL (each line has `text` or `code`) into a FIM eval JSONL.
 
@@ -189,6 +382,8 @@ def make_fim_dataset(input_path, output_path, samples=2000,
         max_middle_chars: Maximum chars for the removed middle span.
         seed: Random seed.
         p_function, p_line, p_identifier, p_token: Sampling probabilities per strategy.
+        workers: Worker processes; > 1 processes FIM_CHUNK_SIZE-line chunks in parallel,
+            each with its own RNG seeded from (seed, chunk index).
 
     Returns:
         Number of written samples (int).
@@ -205,48 +400,23 @@ def make_fim_dataset(input_path, output_path, samples=2000,
     probs = [(k, p / z) for k, p in probs] if z > 0 else probs
 
     in_path, out_path = Path(input_path), Path(output_path)
+    if workers > 1:
+        records = _iter_eval_records_parallel(in_path, workers, seed, probs, min_middle_chars, max_middle_chars)
+    else:
+        records = _iter_eval_records(iter_jsonl_lines(in_path), rng, probs, min_middle_chars, max_middle_chars)
+
     n_written = 0
-    with in_path.open("r", encoding="utf-8") as fin, out_path.open("w", encoding="utf-8") as fout:
-        for line in fin:
-            if n_written >= samples: break
-            try:
-                obj = json.loads(line)
-            except Exception:
-                continue
-            base_text = obj.get("text") or obj.get("code") or ""
-            lf = obj.get("llm_formatted")
-            # resolve llm_formatted text if present
-            if isinstance(lf, str):
-                llm_text = lf
-            elif isinstance(lf, dict):
-                llm_text = lf.get("text") or ""
-            else:
-                llm_text = ""
-
-            # choose a single candidate: prefer llm_formatted if the field exists in the object; otherwise use base text
-            selected = llm_text if ("llm_formatted" in obj) else base_text
-
-            # skip if selected is empty or too short to build a valid FIM span
-            if not selected or len(selected) < (min_middle_chars + 10):
-                continue
-
-            # pick strategy
-            r = rng.random()
-            acc = 0.0
-            strategy = "token"
-            for k, p in probs:
-                acc += p
-                if r <= acc:
-                    strategy = k
-                    break
-            # select span
-            span = pick_span(selected, strategy, min_middle_chars, max_middle_chars, rng.randint(0, 10**9))
-            if not span:
-                continue
-            rec = build_fim_record(selected, span)
-            rec["meta"]["strategy"] = strategy
-            fout.write(json.dumps(rec, ensure_ascii=False) + "\n")
+    out_buf = bytearray()
+    with out_path.open("wb", buffering=IO_BUFFER_SIZE) as fout:
+        # islice stops before pulling (and building) a record beyond the sample limit
+        for line in islice(records, max(0, samples)):
+            out_buf += line
             n_written += 1
+            if len(out_buf) >= IO_BUFFER_SIZE:
+                fout.write(out_buf)
+                out_buf.clear()
+        fout.write(out_buf)
+    records.close()
 
     return n_written
 
@@ -254,7 +424,7 @@ def sample_fim_and_mix_for_file(input_path, output_path, fim_percent=20.0,
                                 min_middle_chars=80, max_middle_chars=1200,
                                 seed=42, p_function=0.4, p_line=0.3,
                                 p_identifier=0.2, p_token=0.1,
-                                mix_mode="interleave"):
+                                mix_mode="interleave", workers=1):
     """
     For a single JSONL file: randomly sample X% of lines to convert to FIM.
     Two mixing modes are supported:
@@ -268,6 +438,8 @@ def sample_fim_and_mix_for_file(input_path, output_path, fim_percent=20.0,
         output_path: Output JSONL file path (recommend: original_name_{X}FIM.jsonl).
         fim_percent: Sampling percent (0-100).
         mix_mode: "interleave" or "random_replay".
+        workers: Worker processes for FIM conversion; > 1 converts FIM_CHUNK_SIZE-item chunks
+            in parallel, each with its own RNG seeded from (seed, chunk index).
         Other args are the same as FIM span selection parameters.
 
     Returns:
@@ -283,34 +455,23 @@ def sample_fim_and_mix_for_file(input_path, output_path, fim_percent=20.0,
     z = sum(p for _, p in probs)
     probs = [(k, p / z) for k, p in probs] if z > 0 else probs
 
-    def choose_strategy(local_rng):
-        r = local_rng.random()
-        acc = 0.0
-        for k, p in probs:
-            acc += p
-            if r <= acc:
-                return k
-        return probs[-1][0] if probs else "token"
-
     # read and collect valid items
     # items: List[Tuple[str, Optional[str]]] => (base_text, llm_text)
     items = []
-    with Path(input_path).open("r", encoding="utf-8") as fin:
-        for line in fin:
-            try:
-                obj = json.loads(line)
-            except Exception:
-                continue
-            base_text = obj.get("text") or obj.get("code") or ""
-            lf = obj.get("llm_formatted")
-            if isinstance(lf, str):
-                llm_text = lf
-            elif isinstance(lf, dict):
-                llm_text = lf.get("text")
-            else:
-                llm_text = None
-            if base_text or llm_text:
-                items.append((base_text or "", llm_text if isinstance(llm_text, str) else None))
+    for line in iter_jsonl_lines(input_path):
+        obj = load_jsonl_object(line)
+        if obj is None:
+            continue
+        base_text = obj.get("text") or obj.get("code") or ""
+        lf = obj.get("llm_formatted")
+        if isinstance(lf, str):
+            llm_text = lf
+        elif isinstance(lf, dict):
+            llm_text = lf.get("text")
+        else:
+            llm_text = None
+        if base_text or llm_text:
+            items.append((base_text or "", llm_text if isinstance(llm_text, str) else None))
 
     if not items:
         # still create an empty file
@@ -320,43 +481,28 @@ def sample_fim_and_mix_for_file(input_path, output_path, fim_percent=20.0,
     total = len(items)
     n_fim_target = max(0, min(total, int(round((fim_percent / 100.0) * total))))
 
-    # choose indices to be converted to FIM
-    all_indices = list(range(total))
-    fim_indices = set(rng.sample(all_indices, n_fim_target)) if n_fim_target > 0 else set()
-
-    fim_list = []      # List[str] FIM-converted texts (from base and llm_formatted)
-    origin_list = []   # List[str] original base texts
-
-    local_rng = random.Random(seed ^ 0xC0FFEE)
-    for idx, pair in enumerate(items):
-        base_text, llm_text = pair
-        # keep original base text always
-        if base_text:
-            origin_list.append(base_text)
-        # if selected, try build FIM for base and llm_formatted
-        if idx in fim_indices:
-            if base_text and len(base_text) >= (min_middle_chars + 10):
-                rec_text = None
-                for _ in range(12):
-                    strategy = choose_strategy(local_rng)
-                    span = pick_span(base_text, strategy, min_middle_chars, max_middle_chars, local_rng.randint(0, 10**9))
-                    if span:
-                        rec = build_fim_record(base_text, span)
-                        rec_text = rec["text"]
-                        break
-                if rec_text:
-                    fim_list.append(rec_text)
-            if llm_text and len(llm_text) >= (min_middle_chars + 10):
-                rec_text_2 = None
-                for _ in range(12):
-                    strategy = choose_strategy(local_rng)
-                    span = pick_span(llm_text, strategy, min_middle_chars, max_middle_chars, local_rng.randint(0, 10**9))
-                    if span:
-                        rec2 = build_fim_record(llm_text, span)
-                        rec_text_2 = rec2["text"]
-                        break
-                if rec_text_2:
-                    fim_list.append(rec_text_2)
+    # choose indices to be converted to FIM, as a one-byte-per-item mask
+    # (rng.sample accepts the range directly, no materialized index list)
+    fim_mask = bytearray(total)
+    for idx in rng.sample(range(total), n_fim_target):
+        fim_mask[idx] = 1
+
+    # keep original base text always
+    origin_list = [base_text for base_text, _ in items if base_text]   # List[str] original base texts
+    # if selected, try build FIM for base and llm_formatted
+    selected = [pair for pair, is_fim in zip(items, fim_mask) if is_fim]
+    local_seed = seed ^ 0xC0FFEE
+    if workers > 1:
+        # List[str] FIM-converted texts (from base and llm_formatted), concatenated in chunk order
+        tasks = [(local_seed ^ k, selected[i:i + FIM_CHUNK_SIZE], probs, min_middle_chars, max_middle_chars)
+                 for k, i in enumerate(range(0, len(selected), FIM_CHUNK_SIZE))]
+        fim_list = []
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            for texts in imap_ordered(executor, _fim_texts_for_chunk, tasks, workers * 2):
+                fim_list.extend(texts)
+    else:
+        fim_list = fim_texts_for_pairs(selected, random.Random(local_seed), probs,
+                                       min_middle_chars, max_middle_chars)
 
     # build final list according to mix_mode
     mixed = []
@@ -372,22 +518,28 @@ def sample_fim_and_mix_for_file(input_path, output_path, fim_percent=20.0,
         if len_f == 0 or len_o == 0:
             mixed = [*fim_list, *origin_list]
         else:
-            while i < len_f or j < len_o:
-                prog_f = (i / len_f) if len_f else 1.0
-                prog_o = (j / len_o) if len_o else 1.0
-                if i < len_f and (prog_f <= prog_o or j >= len_o):
-                    mixed.append(fim_list[i])
+            # emit FIM while its progress i/len_f is not ahead of j/len_o, compared exactly
+            # as i*len_o <= j*len_f; the output size is known, so fill a preallocated list
+            mixed = [None] * (len_f + len_o)
+            for k in range(len_f + len_o):
+                if i < len_f and (j >= len_o or i * len_o <= j * len_f):
+                    mixed[k] = fim_list[i]
                     i += 1
-                elif j < len_o:
-                    mixed.append(origin_list[j])
+                else:
+                    mixed[k] = origin_list[j]
                     j += 1
 
     # write out
     n_written = 0
-    with Path(output_path).open("w", encoding="utf-8") as fout:
+    out_buf = bytearray()
+    with Path(output_path).open("wb", buffering=IO_BUFFER_SIZE) as fout:
         for txt in mixed:
-            fout.write(json.dumps({"text": txt}, ensure_ascii=False) + "\n")
+            out_buf += dump_jsonl_line({"text": txt})
             n_written += 1
+            if len(out_buf) >= IO_BUFFER_SIZE:
+                fout.write(out_buf)
+                out_buf.clear()
+        fout.write(out_buf)
 
     return n_written
 
@@ -411,6 +563,8 @@ def main():
     ap.add_argument("--output_dir", default=None, help="Output directory (defaults to each input's directory)")
     ap.add_argument("--out_ext", default=".jsonl", help="Output file extension, default .jsonl")
     ap.add_argument("--mix_mode", choices=["interleave", "random_replay"], default="interleave", help="Mixing strategy for outputs")
+    ap.add_argument("--workers", type=int, default=1,
+                    help="Worker processes for FIM construction (default 1; >1 uses per-chunk seeds, so output differs from 1)")
     args = ap.parse_args()
 
     # Branch: if --inputs and --fim_percent are provided, run sampling+mix mode
@@ -435,6 +589,7 @@ def main():
                 p_identifier=args.p_identifier,
                 p_token=args.p_token,
                 mix_mode=args.mix_mode,
+                workers=args.workers,
             )
             print(f"[OK] {in_path} -> {out_path} (written: {n})")
             total_written += n
@@ -457,6 +612,7 @@ def main():
         p_line=args.p_line,
         p_identifier=args.p_identifier,
         p_token=args.p_token,
+        workers=args.workers,
     )
 
     print(f"[OK] wrote {n_written} FIM eval samples to {args.output}")
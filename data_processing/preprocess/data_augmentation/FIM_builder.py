@@ -5,69 +5,72 @@ from utils import *
 from tree_sitter import Language, Parser
 import tree_sitter_typescript as tst
 import random
-import re
 import json
 
 tree_sitter_language = Language(tst.language_typescript())
 parser = Parser()
 parser.language = tree_sitter_language
 
-def extract_functions_from_ast(node, source_code):
-    """Extract all function definitions from AST"""
-    functions = []
+# AST node types treated as functions
+FUNC_TYPES = frozenset({'function_declaration', 'method_definition', 'arrow_function', 'function_expression'})
+
+# Function bodies (whitespace removed, lowercased) that count as empty
+EMPTY_BODIES = frozenset({'', 'return;', 'return'})
+# Arrow function bodies that count as empty
+EMPTY_ARROW_BODIES = frozenset({'{}', '{ }', '{return;}', '{return}'})
+
+def is_empty_function(function_code):
+    """Check if function is empty or minimal (like () => { })"""
+    # Remove whitespace and newlines for analysis
+    cleaned = function_code.strip().replace('\n', '').replace('\r', '').replace(' ', '').replace('\t', '')
     
-    def is_empty_function(function_code):
-        """Check if function is empty or minimal (like () => { })"""
-        # Remove whitespace and newlines for analysis
-        cleaned = function_code.strip().replace('\n', '').replace('\r', '').replace(' ', '').replace('\t', '')
+    # Check for very short functions (likely empty)
+    if len(cleaned) < 10:
+        return True
+    
+    # Extract function body (content between the first { and the last })
+    i = function_code.find('{')
+    j = function_code.rfind('}')
+    if 0 <= i < j:
+        body = function_code[i + 1:j].strip()
         
-        # Check for very short functions (likely empty)
-        if len(cleaned) < 10:
+        # Check if body is empty or contains only return/whitespace
+        if ''.join(body.split()).lower() in EMPTY_BODIES:
             return True
         
-        # Extract function body (content between { and })
-        body_match = re.search(r'\{([^}]*)\}', function_code)
-        if body_match:
-            body = body_match.group(1).strip()
-            
-            # Check if body is empty or contains only return/whitespace
-            if not body:  # Completely empty body
-                return True
-            
-            # Remove whitespace and check common empty patterns
-            clean_body = re.sub(r'\s+', '', body)
-            empty_body_patterns = [
-                 '',  # empty
-                 'return;',
-                 'return',
-                 '//.*',  # only comments
-                 r'/\*.*\*/',  # only comments
-             ]
-            
-            if clean_body.lower() in [p.lower() for p in empty_body_patterns]:
-                return True
-            
-            # Check if body only contains comments
-            if re.match(r'^\s*(//.*|/\*.*\*/)?\s*$', body):
-                return True
-        
-        # Check for arrow functions with empty body
-        if '=>' in function_code:
-            # Extract part after =>
-            arrow_parts = function_code.split('=>', 1)
-            if len(arrow_parts) > 1:
-                arrow_body = arrow_parts[1].strip()
-                if arrow_body in ['{}', '{ }', '{return;}', '{return}']:
-                    return True
-        
-        return False
+        # Check if body only contains a single-line comment
+        if '\n' not in body and (body.startswith('//') or (body.startswith('/*') and body.endswith('*/'))):
+            return True
+    
+    # Check for arrow functions with empty body
+    if '=>' in function_code:
+        # Extract part after =>
+        arrow_body = function_code.split('=>', 1)[1].strip()
+        if arrow_body in EMPTY_ARROW_BODIES:
+            return True
+    
+    return False
+
+def extract_functions_from_ast(node, source_bytes, include_nested=False):
+    """Extract function definitions from AST.
+
+    `source_bytes` is the UTF-8 source the tree was parsed from; node byte
+    offsets index into it, and each function's code is decoded from it.
+    By default the walk does not descend into a function once it is captured,
+    so only outermost functions are returned; pass include_nested=True to also
+    collect functions nested inside other functions.
+    """
+    functions = []
     
-    def traverse(node):
+    # Iterative pre-order traversal (explicit stack instead of recursion)
+    stack = [node]
+    while stack:
+        node = stack.pop()
         # Check for function declarations and method definitions
-        if node.type in ['function_declaration', 'method_definition', 'arrow_function', 'function_expression']:
+        if node.type in FUNC_TYPES:
             start_byte = node.start_byte
             end_byte = node.end_byte
-            function_code = source_code[start_byte:end_byte]
+            function_code = source_bytes[start_byte:end_byte].decode('utf-8')
             
             # Skip empty or minimal functions
             if not is_empty_function(function_code):
@@ -78,16 +81,17 @@ def extract_functions_from_ast(node, source_code):
                     'start_point': node.start_point,
                     'end_point': node.end_point
                 })
+                # Nested functions are part of this function's code; skip its subtree
+                if not include_nested:
+                    continue
         
-        # Recursively traverse child nodes
-        for child in node.children:
-            traverse(child)
+        # Push children reversed so they are visited in source order
+        stack.extend(reversed(node.children))
     
-    traverse(node)
     return functions
 
-def build_fim_data(source_code, functions):
-    """Build FIM (Fill-In-the-Middle) data from source code and extracted functions"""
+def build_fim_data(source_bytes, functions):
+    """Build FIM (Fill-In-the-Middle) data from UTF-8 source bytes and extracted functions"""
     if not functions:
         return None
     
@@ -95,13 +99,13 @@ def build_fim_data(source_code, functions):
     selected_function = random.choice(functions)
     
     # Extract prefix (code before the function)
-    prefix = source_code[:selected_function['start_byte']]
+    prefix = source_bytes[:selected_function['start_byte']].decode('utf-8')
     
-    # Extract middle (the selected function)
-    middle = source_code[selected_function['start_byte']:selected_function['end_byte']]
+    # Extract middle (the selected function, already decoded)
+    middle = selected_function['code']
     
     # Extract suffix (code after the function)
-    suffix = source_code[selected_function['end_byte']:]
+    suffix = source_bytes[selected_function['end_byte']:].decode('utf-8')
     
     return {
         'prefix': prefix,
@@ -126,15 +130,17 @@ def process_code_samples(input_file, output_file):
         if not code_content:
             continue
             
-        # Parse the code into syntax tree
-        syntax_tree = parser.parse(code_content.encode('utf-8'))
+        # Parse the code into syntax tree; tree-sitter offsets are byte offsets,
+        # so slicing is done on the encoded source
+        source_bytes = code_content.encode('utf-8')
+        syntax_tree = parser.parse(source_bytes)
         
         # Extract all functions from AST
-        functions = extract_functions_from_ast(syntax_tree.root_node, code_content)
+        functions = extract_functions_from_ast(syntax_tree.root_node, source_bytes)
         
         if functions:
             # Build FIM data
-            fim_data = build_fim_data(code_content, functions)
+            fim_data = build_fim_data(source_bytes, functions)
             if fim_data:
                 fim_data['source_id'] = id
                 fim_data['fim_type'] = "function"
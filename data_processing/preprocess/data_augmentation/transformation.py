@@ -1,145 +1,143 @@
 import sys
 import os
+import json
 import random
 import string
+import functools
+from multiprocessing import Pool
+from bisect import bisect_right
 sys.path.append(os.path.join(os.path.dirname(__file__), '..', '..'))
 from utils import *
-from tree_sitter import Language, Parser
+from tree_sitter import Language, Parser, Query, QueryCursor
 import tree_sitter_typescript as tst
 
 tree_sitter_language = Language(tst.language_typescript())
 parser = Parser()
 parser.language = tree_sitter_language
 
+# Compiled once at import; matching runs inside the tree-sitter C core.
+# One pass yields declared variables and parameters (rename candidates)
+# together with every identifier (rename sites).
+RENAME_QUERY = Query(
+    tree_sitter_language,
+    """
+    (variable_declarator
+        name: (identifier) @var_decl)
+    (required_parameter
+        (identifier) @param)
+    (optional_parameter
+        (identifier) @param)
+    (identifier) @identifier
+    (type_annotation) @type_context
+    (import_statement) @import_export
+    (export_statement) @import_export
+    """
+)
+
+
+# Built-in globals and keywords that are never renamed
+BUILTIN_NAMES = frozenset({
+    'console', 'window', 'document', 'process', 'require', 'module', 'exports',
+    'Promise', 'Set', 'Map', 'Array', 'Object', 'String', 'Number', 'Boolean',
+    'Error', 'Date', 'RegExp', 'JSON', 'Math', 'parseInt', 'parseFloat'
+})
+
+
+@functools.lru_cache(maxsize=256)
+def parse_code(code_bytes):
+    """Parse UTF-8 source bytes, reusing the tree for recently seen identical sources (trees are never modified)."""
+    return parser.parse(code_bytes)
+
+
+def merge_node_ranges(nodes):
+    """Merge the byte ranges of `nodes` into sorted, disjoint (starts, ends) lists."""
+    starts, ends = [], []
+    for start, end in sorted((n.start_byte, n.end_byte) for n in nodes):
+        if ends and start < ends[-1]:
+            # overlapping or nested: extend the current range
+            ends[-1] = max(ends[-1], end)
+        else:
+            starts.append(start)
+            ends.append(end)
+    return starts, ends
+
+
+def node_in_ranges(node, ranges):
+    """True if `node` lies inside one of the merged `ranges`, i.e. has an ancestor among the ranged nodes."""
+    starts, ends = ranges
+    i = bisect_right(starts, node.start_byte) - 1
+    return i >= 0 and node.end_byte <= ends[i]
+
 class VariableRenamer:
-    def __init__(self, code_content):
+    def __init__(self, code_content, syntax_tree=None):
         self.code_content = code_content
-        self.syntax_tree = parser.parse(code_content.encode('utf-8'))
+        # tree-sitter node offsets are byte offsets into this buffer
+        self.code_bytes = code_content.encode('utf-8')
+        # callers that already parsed code_content can pass the tree in
+        self.syntax_tree = syntax_tree if syntax_tree is not None else parse_code(self.code_bytes)
         self.variable_mappings = {}
         self.used_names = set()
+        # identifier nodes captured by find_variables_to_rename, reused by apply_renaming
+        self.identifier_nodes = None
+        # merged byte ranges of type annotations / import+export statements (set with
+        # identifier_nodes), so context checks are a bisect instead of a parent-chain climb
+        self.type_context_ranges = ([], [])
+        self.import_export_ranges = ([], [])
     
     def generate_random_name(self, length=8):
         """Generate a random variable name."""
-        while True:
-            name = ''.join(random.choices(string.ascii_letters, k=length))
-            if name not in self.used_names and not name[0].isdigit():
-                self.used_names.add(name)
-                return name
+        return self.generate_random_names(1, length)[0]
+    
+    def generate_random_names(self, count, length=8):
+        """Generate `count` distinct random variable names not used before."""
+        names = []
+        while len(names) < count:
+            # draw the letters for all missing names at once, then cut them into names;
+            # only a (rare) clash with a used name needs another round
+            letters = ''.join(random.choices(string.ascii_letters, k=(count - len(names)) * length))
+            for i in range(0, len(letters), length):
+                name = letters[i:i + length]
+                if name not in self.used_names:
+                    self.used_names.add(name)
+                    names.append(name)
+        return names
     
     def find_variables_to_rename(self):
         """Find all variables that can be renamed."""
         variables_to_rename = []
         
-        def traverse(node, parent=None):
-            if node.type == 'identifier':
-                text = self.code_content[node.start_byte:node.end_byte]
-                parent_type = parent.type if parent else None
-                
-                # Skip if it's a property name or method name
-                if parent and parent.type in ['property_identifier', 'method_definition', 'call_expression']:
-                    return
-                
-                # Skip built-in types and keywords
-                if text in ['console', 'window', 'document', 'process', 'require', 'module', 'exports']:
-                    return
-                
-                # Skip if it's a type identifier in type annotations
-                if self._is_in_type_context(node):
-                    return
-                
-                # Skip import/export identifiers
-                if self._is_in_import_or_export(node):
-                    return
-                
-                # Skip property names in object literals
-                if self._is_object_property_key(node):
-                    return
-                
-                # Case 1: Variable declarations (const, let, var)
-                if self._is_variable_declaration(node, parent):
-                    variables_to_rename.append({
-                        'type': 'variable_declaration',
-                        'name': text,
-                        'node': node,
-                        'start_byte': node.start_byte,
-                        'end_byte': node.end_byte
-                    })
-                
-                # Case 2: Function parameters
-                elif self._is_function_parameter(node, parent):
-                    variables_to_rename.append({
-                        'type': 'parameter',
-                        'name': text,
-                        'node': node,
-                        'start_byte': node.start_byte,
-                        'end_byte': node.end_byte
-                    })
-                
-            
-            # Process all children
-            for child in node.children:
-                traverse(child, node)
-        
         # Use tree-sitter query for more accurate parameter detection
-        try:
-            from tree_sitter import Query
-            query = Query(
-                tree_sitter_language,
-                """
-                (variable_declarator
-                    name: (identifier) @var_decl)
-                (required_parameter
-                    (identifier) @param)
-                (optional_parameter
-                    (identifier) @param)
-                """
-            )
-            
-            matches = query.matches(self.syntax_tree.root_node)
-            for match in matches:
-                for capture_name, nodes in match.items():
-                    for node in nodes:
-                        text = self.code_content[node.start_byte:node.end_byte]
-                        if capture_name == 'var_decl' and not self._should_skip_identifier(node, text):
-                            variables_to_rename.append({
-                                'type': 'variable_declaration',
-                                'name': text,
-                                'node': node,
-                                'start_byte': node.start_byte,
-                                'end_byte': node.end_byte
-                            })
-                        elif capture_name in ['param'] and not self._should_skip_identifier(node, text):
-                            variables_to_rename.append({
-                                'type': 'parameter',
-                                'name': text,
-                                'node': node,
-                                'start_byte': node.start_byte,
-                                'end_byte': node.end_byte
-                            })
-        except Exception as e:
-            # Fallback to manual traversal if query fails
-            pass
-        
-        # Remove duplicates based on name
-        seen = set()
-        unique_variables = []
+        captures = QueryCursor(RENAME_QUERY).captures(self.syntax_tree.root_node)
+        self.identifier_nodes = captures.get('identifier', [])
+        self.type_context_ranges = merge_node_ranges(captures.get('type_context', []))
+        self.import_export_ranges = merge_node_ranges(captures.get('import_export', []))
+        # Capture lists are not ordered; visit candidates in document order
+        candidates = [(node, 'variable_declaration') for node in captures.get('var_decl', [])]
+        candidates += [(node, 'parameter') for node in captures.get('param', [])]
+        candidates.sort(key=lambda c: c[0].start_byte)
+        for node, var_type in candidates:
+            # node.text is the node's UTF-8 source bytes (offsets are byte offsets)
+            text = node.text.decode('utf-8')
+            if not self._should_skip_identifier(node, text):
+                variables_to_rename.append({
+                    'type': var_type,
+                    'name': text,
+                    'node': node,
+                    'start_byte': node.start_byte,
+                    'end_byte': node.end_byte
+                })
+        
+        # Remove duplicates based on name (first occurrence wins; dicts keep insertion order)
+        unique_variables = {}
         for var in variables_to_rename:
-            if var['name'] not in seen:
-                seen.add(var['name'])
-                unique_variables.append(var)
+            unique_variables.setdefault(var['name'], var)
         
-        return unique_variables
+        return list(unique_variables.values())
     
     def _should_skip_identifier(self, node, text):
         """Determine if an identifier should be skipped."""
         # Skip built-in types and keywords
-        skip_keywords = [
-            'console', 'window', 'document', 'process', 'require', 'module', 'exports',
-            'Promise', 'Set', 'Map', 'Array', 'Object', 'String', 'Number', 'Boolean',
-            'Error', 'Date', 'RegExp', 'JSON', 'Math', 'parseInt', 'parseFloat'
-        ]
-        
-        if text in skip_keywords:
+        if text in BUILTIN_NAMES:
             return True
         
         # Skip if in type context
@@ -158,13 +156,7 @@ class VariableRenamer:
     
     def _is_in_type_context(self, node):
         """Check if identifier is in type annotation or similar context."""
-        current = node
-        while current:
-            parent = current.parent
-            if parent and parent.type in ['type_annotation', 'type_identifier', 'import_statement', 'export_statement']:
-                return True
-            current = parent
-        return False
+        return node_in_ranges(node, self.type_context_ranges) or node_in_ranges(node, self.import_export_ranges)
     
     def _is_object_property_key(self, node):
         """Check if identifier is used as object property key."""
@@ -231,16 +223,10 @@ class VariableRenamer:
             return False
         
         # Check if it's a variable usage (not declaration, not parameter)
-        text = self.code_content[node.start_byte:node.end_byte]
+        text = node.text.decode('utf-8')
         
         # Skip common keywords and built-ins
-        skip_keywords = [
-            'console', 'window', 'document', 'process', 'require', 'module', 'exports',
-            'Promise', 'Set', 'Map', 'Array', 'Object', 'String', 'Number', 'Boolean',
-            'Error', 'Date', 'RegExp', 'JSON', 'Math', 'parseInt', 'parseFloat'
-        ]
-        
-        if text in skip_keywords:
+        if text in BUILTIN_NAMES:
             return False
         
         # Skip if it's a type in type annotations
@@ -269,12 +255,7 @@ class VariableRenamer:
     
     def _is_in_import_or_export(self, node):
         """Check if identifier is part of import/export statement."""
-        current = node
-        while current:
-            if current.type in ['import_statement', 'export_statement']:
-                return True
-            current = current.parent
-        return False
+        return node_in_ranges(node, self.import_export_ranges)
     
     def _is_property_access(self, node):
         """Check if this identifier is part of a property access."""
@@ -320,13 +301,12 @@ class VariableRenamer:
         variables = self.find_variables_to_rename()
         
         # Create mapping for variables to rename
-        for var in variables:
-            if random.random() < probability:
-                new_name = self.generate_random_name()
-                self.variable_mappings[var['name']] = new_name
+        selected = [var for var in variables if random.random() < probability]
+        for var, new_name in zip(selected, self.generate_random_names(len(selected))):
+            self.variable_mappings[var['name']] = new_name
         
         # Apply the renaming
-        if self.variable_mappings:
+        if self.variable_mappings and self.identifier_nodes:
             return self.apply_renaming()
         
         return self.code_content
@@ -336,32 +316,36 @@ class VariableRenamer:
         # Sort replacements by position (reverse order for proper byte handling)
         replacements = []
         
-        def collect_identifiers(node):
-            if node.type == 'identifier':
-                text = self.code_content[node.start_byte:node.end_byte]
-                if text in self.variable_mappings:
-                    replacements.append({
-                        'start': node.start_byte,
-                        'end': node.end_byte,
-                        'new_text': self.variable_mappings[text]
-                    })
-            
-            for child in node.children:
-                collect_identifiers(child)
-        
-        collect_identifiers(self.syntax_tree.root_node)
-        
-        # Sort by start position in reverse order to maintain byte positions
-        replacements.sort(key=lambda x: x['start'], reverse=True)
-        
-        # Apply replacements
-        new_code = self.code_content
+        identifier_nodes = self.identifier_nodes
+        if identifier_nodes is None:
+            identifier_nodes = QueryCursor(RENAME_QUERY).captures(self.syntax_tree.root_node).get('identifier', [])
+        # Match identifiers on their raw bytes; no per-identifier decode
+        mappings_bytes = {old.encode('utf-8'): new.encode('utf-8') for old, new in self.variable_mappings.items()}
+        for node in identifier_nodes:
+            new_text = mappings_bytes.get(node.text)
+            if new_text is not None:
+                replacements.append({
+                    'start': node.start_byte,
+                    'end': node.end_byte,
+                    'new_text': new_text
+                })
+        
+        # Sort by start position
+        replacements.sort(key=lambda x: x['start'])
+        
+        # Apply replacements in one linear pass over the UTF-8 source:
+        # copy the bytes between sites, then the new name. The runs between sites
+        # are memoryview slices, so join copies each byte once with no temporaries
+        source = memoryview(self.code_bytes)
+        parts = []
+        cursor = 0
         for replacement in replacements:
-            new_code = (new_code[:replacement['start']] + 
-                       replacement['new_text'] + 
-                       new_code[replacement['end']:])
+            parts.append(source[cursor:replacement['start']])
+            parts.append(replacement['new_text'])
+            cursor = replacement['end']
+        parts.append(source[cursor:])
         
-        return new_code
+        return b''.join(parts).decode('utf-8')
 
 def demonstrate_transformation():
     """Demonstrate variable renaming on a sample."""
@@ -459,29 +443,56 @@ export class DataService {
     
     print(f"\nTotal variables renamed: {len(renamer2.variable_mappings)}")
 
-def process_dataset(input_file, output_file, probability=0.5):
-    """Process entire dataset with variable renaming."""
-    data = read_jsonl(input_file)
-    
-    augmented_data = []
-    for item in data:
-        original_code = item['text']
-        
-        # Create variable renamer and apply transformation
-        renamer = VariableRenamer(original_code)
-        transformed_code = renamer.rename_variables(probability)
-        
-        # Create new item with transformed code
-        new_item = item.copy()
-        new_item['text'] = transformed_code
-        new_item['augmentation'] = 'variable_renaming'
-        new_item['variable_mappings'] = renamer.variable_mappings
-        
-        augmented_data.append(new_item)
-    
-    # Write augmented data
-    write_jsonl(output_file, augmented_data)
-    print(f"Processed {len(augmented_data)} items. Output saved to {output_file}")
+def _init_worker():
+    """Pool initializer: reseed, since forked workers inherit the parent's random state."""
+    random.seed()
+
+def rename_item(item, probability=0.5):
+    """Return a copy of `item` with variables in its `text` renamed."""
+    original_code = item['text']
+    
+    # Create variable renamer and apply transformation
+    renamer = VariableRenamer(original_code)
+    transformed_code = renamer.rename_variables(probability)
+    
+    # Create new item with transformed code
+    new_item = item.copy()
+    new_item['text'] = transformed_code
+    new_item['augmentation'] = 'variable_renaming'
+    new_item['variable_mappings'] = renamer.variable_mappings
+    return new_item
+
+def iter_jsonl(file_path):
+    """Lazily yield the records of a JSONL file (like utils.read_jsonl, without building a list)."""
+    with open(file_path, 'r', encoding='utf-8') as file:
+        for line in file:
+            try:
+                yield json.loads(line)
+            except json.JSONDecodeError as e:
+                print(f"Error decoding JSON: {e}")
+
+def process_dataset(input_file, output_file, probability=0.5, workers=1):
+    """Process entire dataset with variable renaming.
+
+    Items are streamed: each one is read, renamed and written before the
+    next is needed, so memory does not grow with the dataset. With
+    workers > 1, items are renamed in a process pool (each worker has its
+    own module-level parser); output keeps the input order."""
+    data = iter_jsonl(input_file)
+    
+    n_items = 0
+    with open(output_file, 'w', encoding='utf-8') as fout:
+        if workers > 1:
+            with Pool(processes=workers, initializer=_init_worker) as pool:
+                for new_item in pool.imap(functools.partial(rename_item, probability=probability), data, chunksize=32):
+                    fout.write(json.dumps(new_item, ensure_ascii=False) + '\n')
+                    n_items += 1
+        else:
+            for item in data:
+                fout.write(json.dumps(rename_item(item, probability), ensure_ascii=False) + '\n')
+                n_items += 1
+    
+    print(f"Processed {n_items} items. Output saved to {output_file}")
 
 if __name__ == "__main__":
     # Demonstrate on sample
@@ -3,7 +3,10 @@ import random
 import string
 import json
 import re
+import hashlib
 import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
 sys.path.append(os.path.join(os.path.dirname(__file__), '..', '..'))
 from utils import *
 from tree_sitter import Language, Parser, Query, QueryCursor
@@ -15,6 +18,13 @@ TS_LANGUAGE = Language(tst.language_typescript())
 parser = Parser()
 parser.language = TS_LANGUAGE
 
+# Characters not allowed in a cleaned-up variable name (\W: not alphanumeric per str.isalnum, not "_")
+NON_IDENT_CHAR_RE = re.compile(r"\W")
+
+# Queries are compiled once at import (compiling costs more than running them on a typical file)
+VARIABLE_QUERY = Query(TS_LANGUAGE, "(variable_declarator name: (identifier) @var)")
+IDENTIFIER_QUERY = Query(TS_LANGUAGE, "(identifier) @id")
+
 
 def _random_name(name: str) -> str:
     """Generate a random variable name."""
@@ -23,25 +33,83 @@ def _random_name(name: str) -> str:
     return name + random_digits
 
 
-def _llm_synonym(names: list[str], model: str = "<Model>", prompt_path: str | None = None) -> list[str]:
-    """Return synonyms for variable names using an LLM. Fallback to random names if the
-    request fails."""
-    # Prepare the prompt
-    prompt_template = "Generate semantically similar variable names for the following list. Consider coding conventions and context. Output ONLY a JSON array with the new names in the same order. No other text, no markdown formatting."
+_client: OpenAI | None = None
+_client_lock = threading.Lock()
+
+
+def _get_client() -> OpenAI:
+    """Return the process-wide OpenAI client, creating it on first use.
+
+    Sharing one client keeps its connection pool alive across requests, so
+    only the first request pays for connection setup and the TLS handshake."""
+    global _client
+    with _client_lock:
+        if _client is None:
+            _client = OpenAI(
+                api_key=os.environ.get("DASHSCOPE_API_KEY"),
+                base_url="https://dashscope.aliyuncs.com/compatible-mode/v1",
+            )
+    return _client
+
+
+# Prompt used when no prompt template file is given
+DEFAULT_SYNONYM_PROMPT = "Generate semantically similar variable names for the following list. Consider coding conventions and context. Output ONLY a JSON array with the new names in the same order. No other text, no markdown formatting."
+# Names per synonym request when filling the cache for many files at once
+SYNONYM_BATCH_SIZE = 50
+
+# Process-wide cache of LLM synonyms: (model, prompt id) -> {variable name: cleaned synonym}.
+# Common names (data, value, result, ...) recur across files and are only requested once per
+# model and prompt; the flip side is that every occurrence of a name gets the same synonym.
+_synonym_cache: dict[tuple[str, str], dict[str, str]] = {}
+
+
+def _load_prompt_template(prompt_path: str | None) -> str:
+    """Return the synonym prompt template at `prompt_path`, or the built-in default."""
     if prompt_path and os.path.exists(prompt_path):
         with open(prompt_path, "r", encoding="utf-8") as f:
-            prompt_template = f.read()
-    
+            return f.read()
+    return DEFAULT_SYNONYM_PROMPT
+
+
+def _prompt_id(prompt_template: str) -> str:
+    """Identify a prompt template by a hash of its text."""
+    return hashlib.sha256(prompt_template.encode("utf-8")).hexdigest()[:16]
+
+
+def load_synonym_cache(path: str) -> None:
+    """Merge a JSON snapshot written by `save_synonym_cache` into the synonym cache."""
+    if not os.path.exists(path):
+        return
+    with open(path, "r", encoding="utf-8") as f:
+        data = json.load(f)
+    # Anything but a list of scoped entries (e.g. an unscoped name -> synonym dict) is ignored
+    if not isinstance(data, list):
+        return
+    for entry in data:
+        scope = _synonym_cache.setdefault((entry["model"], entry["prompt_id"]), {})
+        scope.update(entry["synonyms"])
+
+
+def save_synonym_cache(path: str) -> None:
+    """Write the synonym cache as a JSON snapshot, to be reloaded by later runs."""
+    data = [
+        {"model": model, "prompt_id": prompt_id, "synonyms": synonyms}
+        for (model, prompt_id), synonyms in _synonym_cache.items()
+    ]
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False)
+
+
+def _request_synonyms(names: list[str], model: str, prompt_template: str) -> list[str] | None:
+    """Ask the LLM for synonyms of `names` in one request. Returns cleaned names in the
+    same order (empty where the model's answer was unusable), or None if the request or
+    its response failed."""
     # Format the variable names list in the prompt
     names_str = ", ".join(names)
     message = f"{prompt_template}\n\nVariable names: [{names_str}]"
 
     try:
-        client = OpenAI(
-            api_key=os.environ.get("DASHSCOPE_API_KEY"),
-            base_url="https://dashscope.aliyuncs.com/compatible-mode/v1",
-        )
-        completion = client.chat.completions.create(
+        completion = _get_client().chat.completions.create(
             model=model,
             messages=[{"role": "user", "content": message}],
             response_format={"type": "json_object"}
@@ -54,43 +122,159 @@ def _llm_synonym(names: list[str], model: str = "<Model>", prompt_path: str | No
             if isinstance(result, list) and len(result) == len(names):
                 # Clean each name
                 cleaned_results = []
-                for name, i in enumerate(result):
-                    cleaned = "".join(ch if ch.isalnum() or ch == "_" else "_" for ch in str(name))
+                for name in result:
+                    cleaned = NON_IDENT_CHAR_RE.sub("_", str(name))
                     if cleaned and cleaned[0].isdigit():
                         cleaned = f"_{cleaned}"
-                    cleaned_results.append(cleaned or _random_name(names[i]))
+                    cleaned_results.append(cleaned)
                 return cleaned_results
             else:
-                # Fall back to individual processing if list format is wrong
-                return [_random_name(name) for name in names]
+                # Wrong list format
+                return None
         except json.JSONDecodeError:
-            # Fall back to individual processing if JSON parsing fails
-            return [_random_name(name) for name in names]
+            return None
     except Exception as exc:
         print(f"LLM request failed for names {names}: {exc}")
-        return [_random_name(name) for name in names]
+        return None
+
+
+def _fill_synonym_cache(
+    names: list[str],
+    model: str = "<Model>",
+    prompt_path: str | None = None,
+    concurrency: int = 1,
+) -> dict[str, str]:
+    """Request LLM synonyms for the distinct `names` not cached yet for this model and
+    prompt, SYNONYM_BATCH_SIZE names per request and up to `concurrency` requests at a
+    time. Returns the cache for this model and prompt (failed names stay missing)."""
+    prompt_template = _load_prompt_template(prompt_path)
+    scope = _synonym_cache.setdefault((model, _prompt_id(prompt_template)), {})
+    missing = [name for name in dict.fromkeys(names) if name not in scope]
+    batches = [missing[i:i + SYNONYM_BATCH_SIZE] for i in range(0, len(missing), SYNONYM_BATCH_SIZE)]
 
+    def fetch(batch: list[str]) -> None:
+        synonyms = _request_synonyms(batch, model, prompt_template)
+        if synonyms is not None:
+            for name, synonym in zip(batch, synonyms):
+                if synonym:
+                    scope[name] = synonym
 
-def _collect_variable_identifiers(tree, code: str):
-    """Return a mapping of variable names to their identifier nodes."""
-    query = Query(TS_LANGUAGE, "(variable_declarator name: (identifier) @var)")
-    cursor = QueryCursor(query)
+    if concurrency > 1 and len(batches) > 1:
+        with ThreadPoolExecutor(max_workers=concurrency) as ex:
+            list(ex.map(fetch, batches))
+    else:
+        for batch in batches:
+            fetch(batch)
+    return scope
+
+
+def _llm_synonym(names: list[str], model: str = "<Model>", prompt_path: str | None = None) -> list[str]:
+    """Return synonyms for variable names using an LLM. Fallback to random names if the
+    request fails.
+
+    Names already answered for this model and prompt come from the synonym cache; only
+    the remaining distinct names are requested."""
+    scope = _fill_synonym_cache(names, model=model, prompt_path=prompt_path)
+    # Fall back to individual random names for anything the LLM did not answer
+    return [scope.get(name) or _random_name(name) for name in names]
+
+
+def _collect_variable_identifiers(tree) -> list[str]:
+    """Return the distinct declared variable names, in document order."""
+    cursor = QueryCursor(VARIABLE_QUERY)
     capture_dict = cursor.captures(tree.root_node)
-    variables = {}
-    for node in capture_dict.get('var', []):
-        name = code[node.start_byte:node.end_byte]
-        variables.setdefault(name, []).append(node)
-    return variables
+    # Captures come back in no particular order; sort so random.sample is reproducible
+    nodes = sorted(capture_dict.get('var', []), key=lambda node: node.start_byte)
+    # node.text is the node's UTF-8 source bytes (offsets are byte offsets)
+    return list(dict.fromkeys(sys.intern(node.text.decode("utf-8")) for node in nodes))
 
 
 def _collect_all_identifiers(tree):
     """Collect all identifier nodes in the tree."""
-    query = Query(TS_LANGUAGE, "(identifier) @id")
-    cursor = QueryCursor(query)
+    cursor = QueryCursor(IDENTIFIER_QUERY)
     capture_dict = cursor.captures(tree.root_node)
     return capture_dict.get('id', [])
 
 
+def plan_renames(code: str, max_changes: int = 2):
+    """Parse `code` and randomly pick up to `max_changes` declared variable names to rename.
+
+    Returns ``(tree, selected)``; ``selected`` is empty when the code declares no variables."""
+    tree = parser.parse(code.encode("utf-8"))
+    variables = _collect_variable_identifiers(tree)
+    if not variables:
+        return tree, []
+    num_changes = random.randint(1, min(max_changes, len(variables)))
+    selected = random.sample(variables, num_changes)
+    return tree, selected
+
+
+# Mappings up to this size are located with a regex scan instead of walking every identifier
+REGEX_RENAME_MAX = 4
+# Identifier characters in the UTF-8 source: ASCII word characters, "$", and any non-ASCII byte
+_IDENT_BYTE_CLASS = rb"[\w$\x80-\xff]"
+# Parent node types whose identifier children are property names, not variables
+PROPERTY_PARENT_TYPES = frozenset(['property_identifier', 'shorthand_property_identifier'])
+
+
+def _find_renames_by_regex(tree, source: bytes, mapping_bytes: dict[bytes, bytes]):
+    """Locate identifiers to rename by scanning `source` for the old names.
+
+    Each match is kept only if the tree has an identifier node spanning exactly the
+    matched bytes, so the result equals walking every identifier node."""
+    # Longest names first so a name is never shadowed by one of its prefixes
+    names = sorted(mapping_bytes, key=len, reverse=True)
+    pattern = re.compile(
+        rb"(?<!" + _IDENT_BYTE_CLASS + rb")(?:" + b"|".join(map(re.escape, names)) + rb")(?!" + _IDENT_BYTE_CLASS + rb")"
+    )
+    root = tree.root_node
+    replacements = []
+    for match in pattern.finditer(source):
+        start, end = match.span()
+        node = root.descendant_for_byte_range(start, end)
+        if node is None or node.type != 'identifier' or node.start_byte != start or node.end_byte != end:
+            continue
+        parent = node.parent
+        if parent and parent.type in PROPERTY_PARENT_TYPES:
+            continue
+        replacements.append((start, end, mapping_bytes[match.group()]))
+    return replacements
+
+
+def apply_renames(tree, code: str, mapping: dict[str, str]) -> str:
+    """Rewrite every identifier of `code` (parsed as `tree`) whose name is in `mapping`."""
+    if not mapping:
+        return code
+    code_bytes = code.encode("utf-8")
+    # Match identifiers on their raw bytes; no per-identifier decode
+    mapping_bytes = {old.encode("utf-8"): new.encode("utf-8") for old, new in mapping.items()}
+    if len(mapping_bytes) <= REGEX_RENAME_MAX:
+        # Few names (rename_variables picks 1-2): the C regex scan beats visiting every identifier
+        replacements = _find_renames_by_regex(tree, code_bytes, mapping_bytes)
+    else:
+        replacements = []
+        for node in _collect_all_identifiers(tree):
+            new_text = mapping_bytes.get(node.text)
+            if new_text is not None:
+                parent = node.parent
+                if parent and parent.type in PROPERTY_PARENT_TYPES:
+                    continue
+                replacements.append((node.start_byte, node.end_byte, new_text))
+        replacements.sort(key=lambda x: x[0])
+
+    # Splice in one linear pass over the UTF-8 source (node offsets are byte offsets);
+    # memoryview slices let join copy each untouched byte once, with no temporaries
+    source = memoryview(code_bytes)
+    parts = []
+    cursor = 0
+    for start, end, new_text in replacements:
+        parts.append(source[cursor:start])
+        parts.append(new_text)
+        cursor = end
+    parts.append(source[cursor:])
+    return b"".join(parts).decode("utf-8")
+
+
 def rename_variables(
     code: str,
     max_changes: int = 2,
@@ -103,39 +287,48 @@ def rename_variables(
 
     When ``use_llm`` is True, try generating synonyms for the selected variable
     names using the provided LLM model and prompt template."""
-    tree = parser.parse(code.encode("utf-8"))
-    variables = _collect_variable_identifiers(tree, code)
-    if not variables:
+    tree, selected = plan_renames(code, max_changes)
+    if not selected:
         return code
 
-    num_changes = random.randint(1, min(max_changes, len(variables)))
-    selected = random.sample(list(variables.keys()), num_changes)
-    mapping = {}
-    
-    if use_llm and selected:
+    if use_llm:
         # Use LLM to generate synonyms for all selected names at once
         new_names = _llm_synonym(selected, model=model, prompt_path=prompt_path)
-        mapping = dict(zip(selected, new_names))
     else:
         # Use random names
-        for name in selected:
-            mapping[name] = _random_name(name)
+        new_names = [_random_name(name) for name in selected]
+    return apply_renames(tree, code, dict(zip(selected, new_names)))
 
-    id_nodes = _collect_all_identifiers(tree)
-    replacements = []
-    for node in id_nodes:
-        text = code[node.start_byte:node.end_byte]
-        if text in mapping:
-            parent = node.parent
-            if parent and parent.type in ['property_identifier', 'shorthand_property_identifier']:
-                continue
-            replacements.append((node.start_byte, node.end_byte, mapping[text]))
-
-    replacements.sort(key=lambda x: x[0], reverse=True)
-    new_code = code
-    for start, end, new_text in replacements:
-        new_code = new_code[:start] + new_text + new_code[end:]
-    return new_code
+
+def rename_variables_batch(
+    codes: list[str],
+    max_changes: int = 2,
+    *,
+    use_llm: bool = False,
+    model: str = "<Model>",
+    prompt_path: str | None = None,
+    concurrency: int = 8,
+) -> list[str]:
+    """Like `rename_variables` for many code strings, returned in input order.
+
+    All files are planned first; with ``use_llm`` the distinct selected names of all
+    files are then requested together (batched, up to ``concurrency`` requests at a
+    time) instead of one round-trip per file, and the results are applied file by file."""
+    plans = [plan_renames(code, max_changes) for code in codes]
+    if use_llm:
+        scope = _fill_synonym_cache(
+            [name for _, selected in plans for name in selected],
+            model=model,
+            prompt_path=prompt_path,
+            concurrency=max(1, concurrency),
+        )
+        new_names_list = [[scope.get(name) or _random_name(name) for name in selected] for _, selected in plans]
+    else:
+        new_names_list = [[_random_name(name) for name in selected] for _, selected in plans]
+    return [
+        apply_renames(tree, code, dict(zip(selected, new_names)))
+        for code, (tree, selected), new_names in zip(codes, plans, new_names_list)
+    ]
 
 
 def get_variable_synonyms(
@@ -171,12 +364,20 @@ if __name__ == "__main__":
     # test_names = ["userCount", "isActive", "fileName"]
     # synonyms = get_variable_synonyms(test_names, prompt_path=prompt_file, model="deepseek-v3-250324")
     # print(json.dumps(dict(zip(test_names, synonyms)), indent=2))
-    test200 = read_jsonl("./code_data/cleaned_data/test_200.jsonl")
-    for item in test200[:4]:
+    synonym_cache_file = "./code_data/cleaned_data/variable_synonym_cache.json"
+    load_synonym_cache(synonym_cache_file)
+    try:
+        test200 = read_jsonl("./code_data/cleaned_data/test_200.jsonl")
+        samples = test200[:4]
+        renamed = rename_variables_batch([item['text'] for item in samples], use_llm=True, prompt_path=prompt_file, model="qwen3-coder-plus")
+    finally:
+        # Keep every synonym already paid for, even if the run fails partway
+        save_synonym_cache(synonym_cache_file)
+    for item, new_text in zip(samples, renamed):
         print("="*50)
         print("Before transform:")
         print(item['text'])
-        item['text'] = rename_variables(item['text'], use_llm=True, prompt_path=prompt_file, model="qwen3-coder-plus")
+        item['text'] = new_text
         print("After transform:")
         print(item['text'])
         
\ No newline at end of file
@@ -1,7 +1,7 @@
 import multiprocessing
 import sys
 import os
-from functools import partial
+from functools import lru_cache, partial
 from pathlib import Path
 from typing import Any, Dict, List
 
@@ -16,6 +16,7 @@ from utils import *
 
 IGNORE_DIR = ["entry", "features", "commons", "\\"]
 
+@lru_cache(maxsize=200_000)
 def normalize_text(s: str) -> str:
     """
     规范化字符串：转为小写，并移除 '-' 和 '_'
@@ -23,23 +24,31 @@ def normalize_text(s: str) -> str:
     return s.lower().replace('-', '').replace('_', '')
 
 
-def is_item_leaked(item: dict, leaked_set_norm: set) -> bool:
-    """Return True if the item is considered leaked based on its path; False otherwise."""
+def path_prefix(item: dict) -> tuple[str, ...] | None:
+    """Return the first 3 components of the item's path, or None if it is missing, malformed or too short."""
     try:
         normalized_path = os.path.normpath(item["path"])  # type: ignore[index]
-        file_path_components = normalized_path.split(os.path.sep)
+    except (KeyError, TypeError):
+        # Malformed item; treat as non-leaked in tagging and allow in cleaning
+        return None
+    file_path_components = normalized_path.split(os.path.sep)
 
-        # If path is too short, treat it as non-leaked to be permissive
-        if len(file_path_components) < 3:
-            return False
+    # If path is too short, treat it as non-leaked to be permissive
+    if len(file_path_components) < 3:
+        return None
+    return tuple(file_path_components[:3])
 
-        file_path_suffix = "/".join(file_path_components[:3])
-        file_path_suffix_norm = normalize_text(file_path_suffix)
 
-        return any(leak in file_path_suffix_norm for leak in leaked_set_norm)
-    except (KeyError, TypeError):
-        # Malformed item; treat as non-leaked in tagging and allow in cleaning
-        return False
+def is_prefix_leaked(prefix: tuple[str, ...], leaked_set_norm: set) -> bool:
+    """Return True if the path prefix matches any normalized leaked repository name."""
+    file_path_suffix_norm = normalize_text("/".join(prefix))
+    return any(leak in file_path_suffix_norm for leak in leaked_set_norm)
+
+
+def is_item_leaked(item: dict, leaked_set_norm: set) -> bool:
+    """Return True if the item is considered leaked based on its path; False otherwise."""
+    prefix = path_prefix(item)
+    return prefix is not None and is_prefix_leaked(prefix, leaked_set_norm)
 
 
 def check_item_for_leaks(item: dict, leaked_set_norm: set) -> dict | None:
@@ -75,10 +84,18 @@ def tag_llm_judgements_with_leaks(judgements_data: List[Dict[str, Any]], leaked_
     
     tagged_results = []
     leaked_count = 0
+    # Many items share a repo prefix; decide each distinct prefix once
+    leaked_by_prefix: Dict[tuple, bool] = {}
     
     for item in judgements_data:
         item_copy = item.copy()
-        is_leaked = is_item_leaked(item_copy, leaked_set_norm)
+        prefix = path_prefix(item_copy)
+        if prefix is None:
+            is_leaked = False
+        else:
+            is_leaked = leaked_by_prefix.get(prefix)
+            if is_leaked is None:
+                is_leaked = leaked_by_prefix[prefix] = is_prefix_leaked(prefix, leaked_set_norm)
         item_copy['leaked'] = is_leaked
         if is_leaked:
             leaked_count += 1